@@ -1,50 +1,74 @@
 import asyncio
+import json
 import logging
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 from typing import List, Union
 
+from dateutil import parser
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
 from pytz import timezone
 from quart import Quart, jsonify, request
 
-from app import keeper_of_the_state, now_adjusted, predictor
+from app import (keeper_of_the_state, now_adjusted, predictor, response_cache,
+                 shared_state)
+from app.constants import TIME_ZONE
 from app.fybr import zone_info
-from app.fybr.availability_provider import FybrAvailabilityProvider
+from app.fybr.availability_provider import WEBSOCKET_URI, FybrAvailabilityProvider
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
 app = Quart(__name__)
 
-app.fybr_availability_provider = FybrAvailabilityProvider(
-    'wss://streams.smartcolumbusos.com/socket/websocket',
-    []
-)
+MAX_PREDICTION_RANGE = timedelta(days=7)
+
+app.fybr_availability_provider = FybrAvailabilityProvider(WEBSOCKET_URI, [])
+app.background_tasks = []
+
+# set by start.sh so that metrics are collected from every process serving the API
+METRICS_DIR = os.getenv('prometheus_multiproc_dir')
 
 
 @app.before_serving
 async def startup():
     LOGGER.info('starting API')
+    loop = asyncio.get_event_loop()
+
+    if shared_state.SHARED_STATE_DIR is not None:
+        LOGGER.info(f'Following state published to {shared_state.SHARED_STATE_DIR} by the ingestion process')
+        app.fybr_availability_provider = shared_state.SharedAvailabilityProvider(shared_state.SHARED_STATE_DIR)
+        # workers only start serving, and so become ready, once they have models
+        manifest_stamp = await shared_state.wait_for_published_state(shared_state.SHARED_STATE_DIR)
+        app.background_tasks = [
+            loop.create_task(shared_state.follow_published_state(shared_state.SHARED_STATE_DIR, manifest_stamp))
+        ]
+        LOGGER.info('Finished starting API')
+        return
+
     app.fybr_availability_provider = FybrAvailabilityProvider(
-        'wss://streams.smartcolumbusos.com/socket/websocket',
+        WEBSOCKET_URI,
         zone_info.meter_and_zone_list()
     )
-    loop = asyncio.get_event_loop()
+
+    LOGGER.info('Restoring model and zone caches from snapshot')
+    await keeper_of_the_state.restore_snapshot()
 
     LOGGER.info('Scheduling availability cache to be filled from stream')
-    app.fybr_availability_streamer = loop.create_task(app.fybr_availability_provider.handle_websocket_messages())
-    LOGGER.info('Scheduling model and zone caches to be re-warmed periodically')
-    app.model_fetcher = loop.create_task(keeper_of_the_state.fetch_state_periodically())
+    LOGGER.info('Scheduling model and zone caches to be warmed periodically')
+    app.background_tasks = [
+        loop.create_task(app.fybr_availability_provider.handle_websocket_messages()),
+        loop.create_task(keeper_of_the_state.fetch_state_periodically())
+    ]
     LOGGER.info('Finished starting API')
 
-    LOGGER.info('Warming model and zone caches')
-    await keeper_of_the_state.warm_caches()
-    LOGGER.info('Done warming model and zone caches')
-
 
 @app.after_serving
 async def shutdown():
-    app.fybr_availability_streamer.cancel()
-    app.model_fetcher.cancel()
+    for background_task in app.background_tasks:
+        background_task.cancel()
+    if METRICS_DIR is not None:
+        multiprocess.mark_process_dead(os.getpid())
 
 
 @app.route('/healthcheck')
@@ -52,11 +76,40 @@ async def healthcheck():
     return 'OK'
 
 
+@app.route('/readiness')
+async def readiness():
+    checked_at = keeper_of_the_state.provide_state_checked_at()
+    ready = bool(keeper_of_the_state.provide_model('latest')) and bool(keeper_of_the_state.provide_zones())
+
+    return jsonify({
+        'ready': ready,
+        'checkedAt': checked_at.isoformat() if checked_at else None,
+        'ageSeconds': (datetime.now() - checked_at).total_seconds() if checked_at else None
+    }), 200 if ready else 503
+
+
+@app.route('/metrics')
+async def metrics():
+    registry = REGISTRY
+    if METRICS_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=METRICS_DIR)
+    return app.response_class(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
 @app.route('/api/v1/predictions')
 async def predictions():
     now = now_adjusted.adjust(datetime.now(timezone('US/Eastern')))
     zone_ids = _parse_zone_ids(request.args.get('zone_ids'))
 
+    if zone_ids == 'All':
+        return app.response_class(
+            response_cache.all_zone_predictions(
+                now, app.fybr_availability_provider.get_all_availability()
+            ),
+            mimetype='application/json'
+        )
+
     availability = predictor.predict(now, zone_ids)
 
     prediction_transforms = [
@@ -70,6 +123,52 @@ async def predictions():
     return availability
 
 
+@app.route('/api/v1/predictions/range')
+async def predictions_range():
+    try:
+        start = parser.isoparse(request.args['start'])
+        end = parser.isoparse(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end must be ISO 8601 timestamps'}), 400
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        return jsonify({'error': 'start and end must both have a UTC offset or both have none'}), 400
+    if not start < end <= start + MAX_PREDICTION_RANGE:
+        return jsonify({'error': f'end must be after start and at most {MAX_PREDICTION_RANGE} later'}), 400
+
+    zone_ids = _parse_zone_ids(request.args.get('zone_ids'))
+
+    # times with a UTC offset are bucketed by their local time in Columbus
+    if start.tzinfo is not None:
+        start, end = start.astimezone(TIME_ZONE), end.astimezone(TIME_ZONE)
+
+    semihours = []
+    semihour = start.replace(minute=30 * (start.minute // 30), second=0, microsecond=0)
+    while semihour < end:
+        semihours.append(semihour)
+        semihour += timedelta(minutes=30)
+        if semihour.tzinfo is not None:
+            semihour = TIME_ZONE.normalize(semihour)
+
+    availabilities = predictor.predict_many(map(now_adjusted.adjust, semihours), zone_ids)
+
+    async def _stream_predictions():
+        separator = b'['
+        for semihour, availability in zip(semihours, availabilities):
+            predictions = predictor.to_api_format(availability)
+            if not predictions:
+                continue
+            for prediction in predictions:
+                prediction['time'] = semihour.isoformat()
+            yield separator + b','.join(
+                json.dumps(prediction, sort_keys=True, separators=(',', ':')).encode()
+                for prediction in predictions
+            )
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+
+    return app.response_class(_stream_predictions(), mimetype='application/json')
+
+
 def _parse_zone_ids(request_zone_ids_field) -> Union[List[str], str]:
     if (zone_param := request_zone_ids_field) is not None:
         zone_ids = zone_param.split(',')
@@ -102,7 +201,7 @@ async def predictions_comparative():
 
 @app.route('/api/v1/availability')
 async def availability():
-    return jsonify(app.fybr_availability_provider.get_all_availability())
+    return jsonify(dict(app.fybr_availability_provider.get_all_availability()))
 
 
 if __name__ == '__main__':
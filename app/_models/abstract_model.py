@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import ForwardRef, List
+from typing import ForwardRef, FrozenSet, Iterable, List, Mapping
 
 import pandas as pd
 
+from app._models.training_executor import TrainingExecutor
 from app.data_formats import APIPrediction
 
 ModelFeatures = ForwardRef('ModelFeatures')
@@ -11,6 +12,10 @@ ModelFeatures = ForwardRef('ModelFeatures')
 class Model(ABC):
     """An abstract base class for ML models."""
 
+    #: Whether predictions depend only on the day of week and semihour being
+    #: predicted, so that a whole week of them can be computed ahead of time.
+    weekly_periodic = False
+
     @abstractmethod
     def __getstate__(self): ...
 
@@ -21,8 +26,44 @@ class Model(ABC):
     @abstractmethod
     def supported_zones(self): ...
 
+    @property
+    def supported_zone_set(self) -> FrozenSet[str]:
+        """The supported zones as a set, rebuilt whenever they are replaced."""
+        supported_zones = self.supported_zones
+        if getattr(self, '_supported_zone_set_source', None) is not supported_zones:
+            self._supported_zone_set = frozenset(supported_zones)
+            self._supported_zone_set_source = supported_zones
+        return self._supported_zone_set
+
     @abstractmethod
     def train(self, training_data: pd.DataFrame) -> None: ...
 
+    def train_incrementally(self, training_chunks: Iterable[pd.DataFrame]) -> None:
+        """
+        Train on data read one chunk at a time. Models that can fold chunks
+        into their state as they are read should override this, since by
+        default the chunks are concatenated.
+        """
+        self.train(pd.concat(list(training_chunks), ignore_index=True))
+
+    @property
+    def training_executor(self) -> TrainingExecutor:
+        """Fits the independent parts of a model, e.g. one per zone."""
+        if getattr(self, '_training_executor', None) is None:
+            self._training_executor = TrainingExecutor()
+        return self._training_executor
+
+    @training_executor.setter
+    def training_executor(self, training_executor: TrainingExecutor) -> None:
+        self._training_executor = training_executor
+
     @abstractmethod
-    def predict(self, data: ModelFeatures) -> List[APIPrediction]: ...
\ No newline at end of file
+    def predict(self, data: ModelFeatures) -> List[APIPrediction]: ...
+
+    def predict_batches(self, samples_batches: Iterable[List[ModelFeatures]]) -> List[Mapping[str, float]]:
+        """
+        Predict availability for several batches of samples, such as the same
+        zones at different times. Models that can evaluate every batch at once
+        should override this.
+        """
+        return [self.predict(samples_batch) for samples_batch in samples_batches]
\ No newline at end of file
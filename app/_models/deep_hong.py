@@ -7,9 +7,10 @@ import pandas as pd
 from pydantic import BaseModel, conlist, validate_arguments, validator
 from sklearn.neural_network import MLPRegressor
 
+from app import enforcement_calendar
 from app._models.abstract_model import Model, ModelFeatures
-from app.constants import DAY_OF_WEEK, HOURS_END, HOURS_START, UNENFORCED_DAYS
 from app.data_formats import APIPredictionRequest
+from app.enforcement_calendar import TOTAL_ENFORCEMENT_DAYS, TOTAL_SEMIHOURS
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
@@ -17,10 +18,6 @@ if sys.stdout.isatty():
     LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
 
-TOTAL_SEMIHOURS = 2 * (HOURS_END - HOURS_START).hours + abs(HOURS_END.minute - HOURS_START.minute) // 30
-TOTAL_ENFORCEMENT_DAYS = 7 - len(UNENFORCED_DAYS)
-
-
 ModelFeaturesv0EarlyAccessPreRelease = ForwardRef('ModelFeaturesv0EarlyAccessPreRelease')
 
 
@@ -63,30 +60,46 @@ class ModelFeaturesv0EarlyAccessPreRelease(BaseModel):
         """
         timestamp = request.timestamp
 
-        hour_onehot = np.array([timestamp.hour == hour for hour in range(8, 22)])
-        minute_bin_onehot = np.array([30 * minute_bin <= timestamp.minute < 30 * (minute_bin + 1) for minute_bin in range(2)])
-        semihour_onehot = (hour_onehot[:, None] & np.array(minute_bin_onehot)).flatten()[1:]
+        semihour_onehot = _SEMIHOUR_ONEHOT[enforcement_calendar.semihour_index(timestamp)]
+        dayofweek_onehot = _DAYOFWEEK_ONEHOT[enforcement_calendar.day_index(timestamp)]
 
-        enforcement_days = [day.value for day in DAY_OF_WEEK if day not in UNENFORCED_DAYS]
-        dayofweek_onehot = np.array([
-            enforcement_days.index(timestamp.weekday()) == day_index
-            for day_index in range(TOTAL_ENFORCEMENT_DAYS)
-        ])[1:]
+        if not request.zone_ids:
+            return []
 
-        return [ModelFeaturesv0EarlyAccessPreRelease(zone_id=zone_id,
-                                                     semihour_onehot=semihour_onehot.astype(int).tolist(),
-                                                     dayofweek_onehot=dayofweek_onehot.astype(int).tolist())
+        # every zone shares the same one-hot vectors, so only validate them once
+        validated_features = ModelFeaturesv0EarlyAccessPreRelease(
+            zone_id=request.zone_ids[0],
+            semihour_onehot=semihour_onehot.tolist(),
+            dayofweek_onehot=dayofweek_onehot.tolist()
+        )
+        return [validated_features.copy(update={'zone_id': zone_id})
                 for zone_id in request.zone_ids]
 
 
 ModelFeaturesv0EarlyAccessPreRelease.update_forward_refs()
 
 
+def _onehot_encoding(categories: int) -> np.ndarray:
+    """
+    One-hot encode the indices of `categories` categories, dropping the first
+    so encodings are independent. The last row encodes `NOT_ENFORCED`, i.e.
+    index -1, as all zeros.
+    """
+    return np.vstack([np.eye(categories, dtype=int)[:, 1:], np.zeros((1, categories - 1), dtype=int)])
+
+
+_SEMIHOUR_ONEHOT = _onehot_encoding(TOTAL_SEMIHOURS)
+_DAYOFWEEK_ONEHOT = _onehot_encoding(TOTAL_ENFORCEMENT_DAYS)
+
+
 class ParkingAvailabilityModelv0EarlyAccessPreRelease(Model):
+    weekly_periodic = True
+
     def __init__(self):
         super().__init__()
         self._zone_models: MutableMapping[str, MLPRegressor] = {}
         self._supported_zones = []
+        self._stack_zone_models()
 
     def __getstate__(self):
         return {
@@ -97,59 +110,100 @@ class ParkingAvailabilityModelv0EarlyAccessPreRelease(Model):
     def __setstate__(self, state):
         self._zone_models = state['zone_models']
         self._supported_zones = state['supported_zones']
+        self._stack_zone_models()
 
     @property
     def supported_zones(self):
         return self._supported_zones
 
     def train(self, training_data: pd.DataFrame) -> None:
-        zone_id, X, y = (
-            training_data
-                .assign(
-                    available_rate=lambda df: 1 - df.occu_cnt_rate,
-                    dayofweek=lambda df: df.semihour.dt.dayofweek.astype('category'),
-                    semihour=lambda df: pd.Series(
-                        zip(df.semihour.dt.hour, df.semihour.dt.minute),
-                        dtype='category', index=df.index
-                    )
-                )
-                .pipe(
-                    lambda df: (
-                        df.zone_id,
-                        pd.get_dummies(df.loc[:, ['semihour', 'dayofweek']],
-                                       drop_first=True),
-                        df.available_rate
-                    )
-                )
+        slot_codes = enforcement_calendar.slot_codes(training_data.semihour)
+        is_enforced = slot_codes != enforcement_calendar.NOT_ENFORCED
+        training_data = training_data.loc[is_enforced]
+        day_indices, semihour_indices = np.divmod(slot_codes[is_enforced], TOTAL_SEMIHOURS)
+
+        zone_id = training_data.zone_id
+        X = pd.DataFrame(
+            np.hstack([_SEMIHOUR_ONEHOT[semihour_indices], _DAYOFWEEK_ONEHOT[day_indices]]),
+            index=training_data.index
         )
+        y = 1 - training_data.occu_cnt_rate
 
         self._supported_zones = zone_id.unique()
-        for zone in self.supported_zones:
-            LOGGER.info(f'Processing zone {zone}')
-            X_cluster = X[zone_id == zone]
-            y_cluster = y[zone_id == zone]
-
-            LOGGER.info(f'Total (row, col) counts: {X_cluster.shape}')
-            mlp = MLPRegressor(hidden_layer_sizes=(50, 50), activation='relu')
-            mlp.fit(X_cluster, y_cluster)
+        zone_models = self.training_executor.fit_all(
+            _fit_zone_model,
+            {zone: (X_zone, y.loc[X_zone.index])
+             for zone, X_zone in X.groupby(zone_id.to_numpy(), sort=False)},
+            description='zone model'
+        )
+        for zone, mlp in zone_models.items():
             if np.issubdtype(type(zone), np.float64):
                 zone = str(int(zone))
             self._zone_models[zone] = mlp
 
         LOGGER.info(f'Successfully trained {len(self._zone_models)} models')
+        self._stack_zone_models()
+
+    def _stack_zone_models(self) -> None:
+        """
+        Stack the weights of every zone's network into 3-D arrays, so that all
+        zones can be evaluated with one batched matrix product per layer.
+        Networks are left unstacked if they do not all share the same layer
+        shapes and activations.
+        """
+        self._zone_rows = {zone_id: row for row, zone_id in enumerate(self._zone_models)}
+        self._stacked_coefs = self._stacked_intercepts = None
+
+        zone_models = list(self._zone_models.values())
+        layer_shapes = {tuple(coefs.shape for coefs in mlp.coefs_) for mlp in zone_models}
+        activations = {(mlp.activation, mlp.out_activation_) for mlp in zone_models}
+        if len(layer_shapes) != 1 or activations != {('relu', 'identity')}:
+            return
+
+        self._stacked_coefs = [np.stack(layer_coefs)
+                               for layer_coefs in zip(*(mlp.coefs_ for mlp in zone_models))]
+        self._stacked_intercepts = [np.stack(layer_intercepts)
+                                    for layer_intercepts in zip(*(mlp.intercepts_ for mlp in zone_models))]
 
     @validate_arguments
     def predict(self, samples_batch: List[ModelFeaturesv0EarlyAccessPreRelease]) -> Mapping[str, float]:
-        requested_zone_ids = [sample.zone_id for sample in samples_batch
-                              if sample.zone_id in self.supported_zones]
-
-        regressor_feature_array = np.asarray([
+        requested_samples = [sample for sample in samples_batch
+                             if sample.zone_id in self._zone_rows]
+        if not requested_samples:
+            return {}
+
+        if self._stacked_coefs is None:
+            regressor_feature_array = np.asarray([
+                sample.semihour_onehot + sample.dayofweek_onehot
+                for sample in samples_batch
+            ])
+            return {
+                sample.zone_id: self._zone_models[sample.zone_id]
+                                    .predict(regressor_feature_array)
+                                    .clip(0, 1)[0]
+                for sample in requested_samples
+            }
+
+        rows = [self._zone_rows[sample.zone_id] for sample in requested_samples]
+        activations = np.asarray([
             sample.semihour_onehot + sample.dayofweek_onehot
-            for sample in samples_batch
-        ])
-        return {
-            zone_id: self._zone_models[zone_id]
-                         .predict(regressor_feature_array)
-                         .clip(0, 1)[0]
-            for zone_id in requested_zone_ids
-        }
\ No newline at end of file
+            for sample in requested_samples
+        ], dtype=float)
+        output_layer = len(self._stacked_coefs) - 1
+        for layer, (coefs, intercepts) in enumerate(zip(self._stacked_coefs, self._stacked_intercepts)):
+            activations = np.einsum('zi,zio->zo', activations, coefs[rows]) + intercepts[rows]
+            if layer < output_layer:
+                np.maximum(activations, 0, out=activations)
+
+        return dict(zip(
+            (sample.zone_id for sample in requested_samples),
+            activations[:, 0].clip(0, 1).tolist()
+        ))
+
+
+def _fit_zone_model(training_data):
+    X_zone, y_zone = training_data
+    LOGGER.info(f'Total (row, col) counts: {X_zone.shape}')
+    mlp = MLPRegressor(hidden_layer_sizes=(50, 50), activation='relu')
+    mlp.fit(X_zone, y_zone)
+    return mlp
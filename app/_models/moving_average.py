@@ -1,11 +1,11 @@
 import logging
+import math
 import sys
 from datetime import datetime
-from typing import ForwardRef, List, Mapping
+from typing import Iterable, List, Mapping, MutableMapping, NamedTuple, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from pydantic import BaseModel, constr, validate_arguments
 
 from app._models.abstract_model import Model
 from app.data_formats import APIPredictionRequest
@@ -15,16 +15,21 @@ LOGGER.setLevel(logging.INFO)
 if sys.stdout.isatty():
     LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
-AverageFeatures = ForwardRef('AverageFeatures')
+DAYS_PER_WEEK = 7
+SEMIHOURS_PER_DAY = 48
+SLOTS_PER_ZONE = DAYS_PER_WEEK * SEMIHOURS_PER_DAY
 
+# observations this long before the newest one are forgotten, as they would be
+# by retraining on the last six months of occupancy
+OBSERVATION_WINDOW = pd.DateOffset(months=6)
 
-class AverageFeatures(BaseModel):
-    zone_id: constr(min_length=1)
+
+class AverageFeatures(NamedTuple):
+    zone_id: str
     at: datetime
 
     @staticmethod
-    @validate_arguments
-    def from_request(request: APIPredictionRequest) -> List[AverageFeatures]:
+    def from_request(request: APIPredictionRequest) -> List['AverageFeatures']:
         f"""
         Convert a prediction request to the input format expected by a parking
         availability model.
@@ -32,7 +37,8 @@ class AverageFeatures(BaseModel):
         Parameters
         ----------
         request : APIPredictionRequest
-            The prediction request to transform into model features
+            The prediction request to transform into model features, which
+            is expected to have already been validated
 
         Returns
         -------
@@ -40,47 +46,61 @@ class AverageFeatures(BaseModel):
             A set of features that can be passed into the `predict` method of a
             `AverageFeatures`.
         """
-        return [AverageFeatures(zone_id=zone_id, at=request.timestamp)
-                for zone_id in request.zone_ids]
-
-
-AverageFeatures.update_forward_refs()
+        timestamp = request.timestamp
+        return [AverageFeatures(zone_id, timestamp) for zone_id in request.zone_ids]
 
 
 class AvailabilityAverager(Model):
+    weekly_periodic = True
+
     def __init__(self, weeks_to_average=1):
         super().__init__()
         self._supported_zones: List[str] = []
         self._weeks_to_average = weeks_to_average
+        self._zone_rows: Mapping[str, int] = {}
+        self._availability_table = np.full((0, DAYS_PER_WEEK, SEMIHOURS_PER_DAY), np.nan)
+        self._recent_zone_ids: Optional[List[str]] = None
+        self._recent_observations: Optional[_RecentObservations] = None
 
     def __eq__(self, other):
         if not isinstance(other, AvailabilityAverager):
             return False
-        rolling_average_ids = set(self._rolling_averages.keys())
-        other_rolling_average_ids = set(other._rolling_averages.keys())
         return (
-            (rolling_average_ids == other_rolling_average_ids) and
-            all(
-                (
-                    self._rolling_averages[key] == other._rolling_averages[key]
-                ).all().all()
-                for key in rolling_average_ids
-            ) and
+            np.array_equal(self._availability_table, other._availability_table, equal_nan=True) and
             (self.supported_zones == other.supported_zones) and
             (self.weeks_to_average == other.weeks_to_average)
         )
 
     def __getstate__(self):
-        return {
-            'rolling_averages': self._rolling_averages,
+        state = {
+            'availability_table': self._availability_table,
             'supported_zones': self.supported_zones,
             'weeks_to_average': self.weeks_to_average
         }
+        if self.can_update:
+            state.update({
+                'recent_zone_ids': self._recent_zone_ids,
+                **{f'recent_{field}': array
+                   for field, array in self._recent_observations._asdict().items()}
+            })
+        return state
 
     def __setstate__(self, state):
-        self._rolling_averages = state['rolling_averages']
-        self._supported_zones = state['supported_zones']
+        self._supported_zones = list(state['supported_zones'])
         self._weeks_to_average = state['weeks_to_average']
+        if 'rolling_averages' in state:
+            # models archived before the availability table was persisted
+            self._compile_availability_table(state['rolling_averages'].values())
+        else:
+            self._zone_rows = {zone_id: row for row, zone_id in enumerate(self.supported_zones)}
+            self._availability_table = state['availability_table']
+
+        # models archived before they could be updated must be retrained
+        self._recent_zone_ids = state.get('recent_zone_ids')
+        self._recent_observations = (
+            _RecentObservations(*(state[f'recent_{field}'] for field in _RecentObservations._fields))
+            if self._recent_zone_ids is not None else None
+        )
 
     @property
     def supported_zones(self) -> List[str]:
@@ -90,86 +110,243 @@ class AvailabilityAverager(Model):
     def weeks_to_average(self) -> int:
         return self._weeks_to_average
 
+    @property
+    def can_update(self) -> bool:
+        """Whether the model kept the observations needed to `update` it."""
+        return self._recent_observations is not None
+
+    @property
+    def watermark(self) -> Optional[pd.Timestamp]:
+        """The time of the most recent observation the model was trained on."""
+        if not self.can_update or not len(self._recent_observations.times):
+            return None
+        return pd.Timestamp(int(self._recent_observations.times.max()))
+
     def train(self, training_data: pd.DataFrame) -> None:
-        training_data = training_data.assign(
-            available_rate=lambda df: 1 - df.occu_cnt_rate,
-            dayofweek=lambda df: df.semihour.dt.dayofweek.astype('category'),
-            semihour_tuples=lambda df: pd.Series(
-                zip(df.semihour.dt.hour, df.semihour.dt.minute),
-                dtype='category', index=df.index
+        self.train_incrementally([training_data])
+
+    def train_incrementally(self, training_chunks: Iterable[pd.DataFrame]) -> None:
+        """
+        Average each zone's availability over the most recent weeks at every
+        semihour of the week, reading the training data one chunk at a time.
+
+        Observations are grouped by an integer code for their (zone, day of
+        week, semihour) slot. Only the `weeks_to_average + 1` most recent
+        observations of each slot are kept between chunks, and each slot's
+        prediction is the mean of the `weeks_to_average` observations before
+        its latest one, so slots with a single observation are left out.
+        """
+        self._recent_zone_ids = []
+        self._recent_observations = _RecentObservations.empty()
+        self.update(training_chunks)
+
+    def update(self, training_chunks: Iterable[pd.DataFrame]) -> None:
+        """
+        Fold new observations into a trained model. Observations already
+        trained on are replaced rather than counted twice, so the new data may
+        overlap what the model has seen. Observations older than
+        `OBSERVATION_WINDOW` before the newest one are dropped, along with
+        zones that are left without any.
+
+        Raises
+        ------
+        ValueError
+            If the model was archived without the observations it needs to be
+            updated.
+        """
+        if not self.can_update:
+            raise ValueError('This model did not keep the observations needed to update it')
+
+        zone_codes: MutableMapping[str, int] = {zone_id: code for code, zone_id in enumerate(self._recent_zone_ids)}
+        recent_observations = self._recent_observations
+
+        for training_chunk in training_chunks:
+            recent_observations = recent_observations.merge(
+                _RecentObservations.from_frame(training_chunk, zone_codes),
+                self.weeks_to_average + 1
             )
+            LOGGER.info(f'Kept {len(recent_observations.slot_codes)} recent observations '
+                        f'after reading {len(training_chunk)} more')
+
+        zone_ids = list(zone_codes)
+        if len(recent_observations.times):
+            cutoff = pd.Timestamp(int(recent_observations.times.max())) - OBSERVATION_WINDOW
+            recent_observations, zone_ids = recent_observations.since(cutoff.value, zone_ids)
+
+        self._recent_zone_ids = zone_ids
+        self._recent_observations = recent_observations
+        self._compile_recent_observations(recent_observations, self._recent_zone_ids)
+
+    def _compile_recent_observations(self, recent_observations: '_RecentObservations', zone_ids: List[str]) -> None:
+        weeks_ago = recent_observations.weeks_ago()
+        in_window = (weeks_ago >= 1) & (weeks_ago <= self.weeks_to_average)
+        slot_averages = (
+            pd.Series(recent_observations.available_rates[in_window])
+                .groupby(recent_observations.slot_codes[in_window])
+                .mean()
+                .dropna()
+                .clip(0, 1)
         )
-        LOGGER.info(f"At start, {len(training_data)}")
-        training_data = training_data.sort_values(
-            ['zone_id', 'dayofweek', 'semihour_tuples']
+        LOGGER.info(f'Averaged, {len(slot_averages)}')
+
+        averaged_zone_codes, days, semihours_of_day = np.unravel_index(
+            slot_averages.index.to_numpy(),
+            (len(zone_ids), DAYS_PER_WEEK, SEMIHOURS_PER_DAY)
         )
-        LOGGER.info(f"Sorted, {len(training_data)}")
-        training_data[f'available_rate_{self.weeks_to_average:0>2}w'] = (
-            training_data.groupby(
-                ['zone_id', 'dayofweek', 'semihour_tuples']
-            ).available_rate.transform(
-                lambda group: group.shift().rolling(self.weeks_to_average, 1).mean()
-            ).dropna().clip(0, 1)
+        supported_zone_ids = np.unique(np.asarray(zone_ids, dtype=object)[np.unique(averaged_zone_codes)])
+
+        self._supported_zones = supported_zone_ids.tolist()
+        self._zone_rows = {zone_id: row for row, zone_id in enumerate(self.supported_zones)}
+        self._availability_table = np.full(
+            (len(self.supported_zones), DAYS_PER_WEEK, SEMIHOURS_PER_DAY),
+            np.nan
         )
-        LOGGER.info(f"Grouped?, {len(training_data)}")
-        training_data = training_data[
-            [
-                'zone_id', 'semihour', 'semihour_tuples', 'dayofweek',
-                f'available_rate_{self.weeks_to_average:0>2}w'
-            ]
-        ].dropna()
-        LOGGER.info(f"Dropped, {len(training_data)}")
-        self._rolling_averages = {
-            zone_day_time: data_in_zone_on_day_at_time
-            for zone_day_time, data_in_zone_on_day_at_time
-            in training_data.groupby(['zone_id', 'dayofweek',
-                                      'semihour_tuples'])
-        }
+        zone_rows_by_code = np.asarray([self._zone_rows.get(zone_id, -1) for zone_id in zone_ids], dtype=np.int64)
+        self._availability_table[
+            zone_rows_by_code[averaged_zone_codes], days, semihours_of_day
+        ] = slot_averages.to_numpy()
 
-        def _get_zone_from_key(key):
-            zone_id, _d, _s = key
-            return zone_id
+    def _compile_availability_table(self, rolling_averages: Iterable[pd.DataFrame]) -> None:
+        """
+        Compile the most recent rolling average of every (zone, day of week,
+        semihour) into a dense `[zone, dayofweek, semihour]` array, so that
+        predicting for a batch of zones is a single array lookup.
 
-        zone_list = list(map(_get_zone_from_key, self._rolling_averages.keys()))
-        unique_zone_list = np.unique(np.array(zone_list)).tolist()
-        self._supported_zones = unique_zone_list
+        Parameters
+        ----------
+        rolling_averages : iterable of pandas.DataFrame
+            Frames of rolling averages, each with `zone_id`, `semihour` and
+            `available_rate_XXw` columns.
+        """
+        self._zone_rows = {zone_id: row for row, zone_id in enumerate(self.supported_zones)}
+        self._availability_table = np.full(
+            (len(self.supported_zones), DAYS_PER_WEEK, SEMIHOURS_PER_DAY),
+            np.nan
+        )
 
+        rolling_averages = [frame for frame in rolling_averages if not frame.empty]
+        if not rolling_averages:
+            return
+
+        rolling_average_column = f'available_rate_{self.weeks_to_average:0>2}w'
+        latest_rolling_averages = (
+            pd.concat(rolling_averages, ignore_index=True)
+                .assign(
+                    date=lambda df: df.semihour.dt.normalize(),
+                    dayofweek=lambda df: df.semihour.dt.dayofweek,
+                    semihour_of_day=lambda df: 2 * df.semihour.dt.hour + df.semihour.dt.minute // 30
+                )
+                .sort_values('date', ascending=False, kind='mergesort')
+                .drop_duplicates(['zone_id', 'dayofweek', 'semihour_of_day'])
+        )
+        self._availability_table[
+            pd.Index(self.supported_zones).get_indexer(latest_rolling_averages.zone_id),
+            latest_rolling_averages.dayofweek.to_numpy(),
+            latest_rolling_averages.semihour_of_day.to_numpy()
+        ] = latest_rolling_averages[rolling_average_column].to_numpy()
 
     # @validate_arguments
     def predict(self, samples_batch: List[AverageFeatures]) -> Mapping[str, float]:
-        valid_requests = [sample for sample in samples_batch
-                          if sample.zone_id in self.supported_zones]
-        # LOGGER.info(f'Samples, {len(samples_batch)}')
-        # LOGGER.info(f'Valid, {len(valid_requests)}')
-        predictions = {}
-        for sample in valid_requests:
-            sample_timestamp = pd.Timestamp(sample.at)
-            sample_semihour_tuple = (
-                sample_timestamp.hour,
-                30 * (sample_timestamp.minute // 30)
-            )
-            rolling_averages = self._rolling_averages.get((
-                sample.zone_id,
-                sample_timestamp.dayofweek,
-                sample_semihour_tuple
-            ), pd.DataFrame())
-
-            if rolling_averages.empty:
-                # LOGGER.warn(f'Sample {sample.zone_id} empty')
-                # LOGGER.warn(f'Test {test}')
-                continue
-
-            rolling_averages = rolling_averages.assign(
-                date_diff=lambda df: -(
-                    df.semihour.dt.date - sample_timestamp.date()
-                )
-            ).loc[
-                lambda df: df.date_diff == df.date_diff.min()
-            ]
+        return self.predict_batches([samples_batch])[0]
 
-            try:
-                predictions[sample.zone_id] = rolling_averages[f'available_rate_{self.weeks_to_average:0>2}w'].iloc[0]
-            except IndexError:
-                continue
+    def predict_batches(self, samples_batches: Iterable[List[AverageFeatures]]) -> List[Mapping[str, float]]:
+        batch_zone_ids, rows, days, semihours = [], [], [], []
+        for samples_batch in samples_batches:
+            zone_ids = []
+            for sample in samples_batch:
+                row = self._zone_rows.get(sample.zone_id)
+                if row is None:
+                    continue
+                zone_ids.append(sample.zone_id)
+                rows.append(row)
+                days.append(sample.at.weekday())
+                semihours.append(2 * sample.at.hour + sample.at.minute // 30)
+            batch_zone_ids.append(zone_ids)
 
+        availabilities = self._availability_table[rows, days, semihours].tolist()
+
+        predictions, offset = [], 0
+        for zone_ids in batch_zone_ids:
+            predictions.append({
+                zone_id: availability
+                for zone_id, availability in zip(zone_ids, availabilities[offset:offset + len(zone_ids)])
+                if not math.isnan(availability)
+            })
+            offset += len(zone_ids)
         return predictions
+
+
+class _RecentObservations(NamedTuple):
+    """
+    Observations of availability, sorted by slot and then from the most to
+    the least recent.
+    """
+    slot_codes: np.ndarray
+    times: np.ndarray
+    available_rates: np.ndarray
+
+    @classmethod
+    def empty(cls) -> '_RecentObservations':
+        return cls(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64))
+
+    @classmethod
+    def from_frame(cls, training_data: pd.DataFrame, zone_codes: MutableMapping[str, int]) -> '_RecentObservations':
+        """
+        Extract observations from training data, coding zones not yet in
+        `zone_codes` in order of appearance.
+        """
+        chunk_zone_codes, chunk_zone_ids = pd.factorize(training_data.zone_id)
+        zone_codes_in_chunk = np.asarray(
+            [zone_codes.setdefault(zone_id, len(zone_codes)) for zone_id in chunk_zone_ids],
+            dtype=np.int64
+        )
+        semihours = training_data.semihour
+        slot_codes = (
+            (zone_codes_in_chunk[chunk_zone_codes] * DAYS_PER_WEEK + semihours.dt.dayofweek.to_numpy())
+            * SEMIHOURS_PER_DAY
+            + 2 * semihours.dt.hour.to_numpy() + semihours.dt.minute.to_numpy() // 30
+        )
+        return cls(
+            slot_codes,
+            semihours.values.astype('datetime64[ns]').view(np.int64),
+            1 - training_data.occu_cnt_rate.to_numpy(dtype=np.float64)
+        )
+
+    def merge(self, other: '_RecentObservations', observations_per_slot: int) -> '_RecentObservations':
+        """
+        Combine two sets of observations, keeping the most recent of each
+        slot. Where both have an observation of the same slot at the same
+        time, the one from `other` is kept.
+        """
+        slot_codes, times, available_rates = (np.concatenate(arrays) for arrays in zip(other, self))
+        order = np.lexsort((-times, slot_codes))
+        merged = _RecentObservations(slot_codes[order], times[order], available_rates[order])
+
+        # the sort is stable, so of two equal observations the one from `other` comes first
+        is_new = np.ones(len(order), dtype=bool)
+        is_new[1:] = (np.diff(merged.slot_codes) != 0) | (np.diff(merged.times) != 0)
+        merged = _RecentObservations(*(array[is_new] for array in merged))
+
+        is_recent = merged.weeks_ago() < observations_per_slot
+        return _RecentObservations(*(array[is_recent] for array in merged))
+
+    def since(self, cutoff_time: int, zone_ids: List[str]) -> Tuple['_RecentObservations', List[str]]:
+        """
+        Drop observations from before `cutoff_time` (in nanoseconds), and the
+        zones left without any, renumbering the remaining zones in order.
+        """
+        is_recent = self.times >= cutoff_time
+        zone_codes, slots_of_zone = np.divmod(self.slot_codes[is_recent], SLOTS_PER_ZONE)
+        kept_zone_codes, renumbered_zone_codes = np.unique(zone_codes, return_inverse=True)
+        return (
+            _RecentObservations(
+                renumbered_zone_codes * SLOTS_PER_ZONE + slots_of_zone,
+                self.times[is_recent],
+                self.available_rates[is_recent]
+            ),
+            [zone_ids[zone_code] for zone_code in kept_zone_codes]
+        )
+
+    def weeks_ago(self) -> np.ndarray:
+        """How many observations of the same slot are more recent than each one."""
+        return pd.Series(self.slot_codes).groupby(self.slot_codes).cumcount().to_numpy()
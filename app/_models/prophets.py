@@ -2,13 +2,11 @@ import logging
 import sys
 from datetime import datetime
 from itertools import starmap
-from typing import ForwardRef, List, Mapping, MutableMapping
+from typing import List, Mapping, MutableMapping, NamedTuple
 
 import pandas as pd
 from fbprophet import Prophet
 from fbprophet.serialize import model_from_json, model_to_json
-from pydantic import BaseModel, constr, validate_arguments
-from tqdm import tqdm
 
 from app._models.abstract_model import Model
 from app.data_formats import APIPredictionRequest
@@ -19,16 +17,12 @@ if sys.stdout.isatty():
     LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
 
-ProphetableFeatures = ForwardRef('ProphetableFeatures')
-
-
-class ProphetableFeatures(BaseModel):
-    zone_id: constr(min_length=1)
+class ProphetableFeatures(NamedTuple):
+    zone_id: str
     at: datetime
 
     @staticmethod
-    @validate_arguments
-    def from_request(request: APIPredictionRequest) -> List[ProphetableFeatures]:
+    def from_request(request: APIPredictionRequest) -> List['ProphetableFeatures']:
         f"""
         Convert a prediction request to the input format expected by a parking
         availability model.
@@ -36,7 +30,8 @@ class ProphetableFeatures(BaseModel):
         Parameters
         ----------
         request : APIPredictionRequest
-            The prediction request to transform into model features
+            The prediction request to transform into model features, which
+            is expected to have already been validated
 
         Returns
         -------
@@ -44,11 +39,8 @@ class ProphetableFeatures(BaseModel):
             A set of features that can be passed into the `predict` method of a
             `ProphetableFeatures`.
         """
-        return [ProphetableFeatures(zone_id=zone_id, at=request.timestamp)
-                for zone_id in request.zone_ids]
-
-
-ProphetableFeatures.update_forward_refs()
+        timestamp = request.timestamp
+        return [ProphetableFeatures(zone_id, timestamp) for zone_id in request.zone_ids]
 
 
 class ParkingProphet(Model):
@@ -153,29 +145,31 @@ class ParkingProphet(Model):
         refined_training_data = refined_training_data.rename(
             columns={'available_rate': 'y'}
         )
-        zone_models = {}
-        for zone_id, zone_training_data in tqdm(
-                refined_training_data.groupby('zone_id'),
-                desc='Training Parking Zone Models',
-                leave=False
-        ):
-            zone_model = Prophet(yearly_seasonality=False)
-            zone_model.add_regressor('cluster_available_rate')
-            zone_model.fit(zone_training_data)
-            zone_models[zone_id] = zone_model
-        return zone_models
+        return self.training_executor.fit_all(
+            _fit_zone_prophet,
+            dict(iter(refined_training_data.groupby('zone_id'))),
+            description='parking zone model'
+        )
 
     def _train_cluster_models(self, refined_training_data: pd.DataFrame) -> Mapping[str, Prophet]:
         refined_training_data = refined_training_data.rename(
             columns={'cluster_available_rate': 'y'}
         )
-        cluster_models = {}
-        for cluster_id, cluster_training_data in tqdm(
-                refined_training_data.groupby('cluster_id'),
-                desc='Training Clustered Parking Zone Models',
-                leave=False
-        ):
-            cluster_model = Prophet(yearly_seasonality=False)
-            cluster_model.fit(cluster_training_data)
-            cluster_models[cluster_id] = cluster_model
-        return cluster_models
\ No newline at end of file
+        return self.training_executor.fit_all(
+            _fit_cluster_prophet,
+            dict(iter(refined_training_data.groupby('cluster_id'))),
+            description='clustered parking zone model'
+        )
+
+
+def _fit_zone_prophet(zone_training_data: pd.DataFrame) -> Prophet:
+    zone_model = Prophet(yearly_seasonality=False)
+    zone_model.add_regressor('cluster_available_rate')
+    zone_model.fit(zone_training_data)
+    return zone_model
+
+
+def _fit_cluster_prophet(cluster_training_data: pd.DataFrame) -> Prophet:
+    cluster_model = Prophet(yearly_seasonality=False)
+    cluster_model.fit(cluster_training_data)
+    return cluster_model
@@ -0,0 +1,100 @@
+"""
+Responsible for fitting independent models, such as one per parking zone,
+either one after the other or across a pool of worker processes.
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+if sys.stdout.isatty():
+    LOGGER.addHandler(logging.StreamHandler(sys.stdout))
+
+TRAINING_WORKERS = int(os.environ.get('TRAINING_WORKERS', 1))
+
+# inherited by forked workers, so training data is not pickled for each fit
+_SHARED_TRAINING_DATA: Mapping[Hashable, Any] = {}
+
+
+class TrainingExecutor:
+    """
+    Fits independent models, recording how long each one took.
+
+    Parameters
+    ----------
+    workers : int, optional
+        How many processes to fit models in. The default is the
+        `TRAINING_WORKERS` environment variable, or 1, which fits models in
+        the current process.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = TRAINING_WORKERS if workers is None else workers
+        self.timings: Dict[Hashable, float] = {}
+
+    def fit_all(self,
+                fit: Callable[[Any], Any],
+                training_data: Mapping[Hashable, Any],
+                description: str = 'model') -> Dict[Hashable, Any]:
+        """
+        Fit one model per set of training data.
+
+        Parameters
+        ----------
+        fit : callable
+            Fits and returns a model given one value of `training_data`. It
+            must be defined at module level, so that it can be sent to worker
+            processes.
+        training_data : dict
+            The training data for each model, by key (e.g. zone ID).
+        description : str, optional
+            What is being fit, for logging.
+
+        Returns
+        -------
+        dict
+            The fitted models, by the keys of `training_data`.
+        """
+        global _SHARED_TRAINING_DATA
+
+        keys = list(training_data)
+        started_at = time.perf_counter()
+
+        if self.workers <= 1 or len(keys) <= 1:
+            fits = [_timed_fit(fit, training_data[key]) for key in keys]
+        elif 'fork' in multiprocessing.get_all_start_methods():
+            _SHARED_TRAINING_DATA = training_data
+            try:
+                with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    fits = list(pool.map(_timed_shared_fit, repeat(fit), keys))
+            finally:
+                _SHARED_TRAINING_DATA = {}
+        else:
+            with ProcessPoolExecutor(self.workers) as pool:
+                fits = list(pool.map(_timed_fit, repeat(fit), (training_data[key] for key in keys)))
+
+        models = {}
+        for key, (model, seconds) in zip(keys, fits):
+            LOGGER.info(f'Fit {description} {key} in {seconds:.2f}s')
+            self.timings[key] = seconds
+            models[key] = model
+
+        LOGGER.info(f'Fit {len(models)} {description}s in {time.perf_counter() - started_at:.2f}s '
+                    f'with {self.workers} worker(s)')
+        return models
+
+
+def _timed_fit(fit, training_data) -> Tuple[Any, float]:
+    started_at = time.perf_counter()
+    model = fit(training_data)
+    return model, time.perf_counter() - started_at
+
+
+def _timed_shared_fit(fit, key) -> Tuple[Any, float]:
+    return _timed_fit(fit, _SHARED_TRAINING_DATA[key])
@@ -1,17 +1,32 @@
+import threading
 from os import environ, path
 
 import boto3
 import botocore
 import hvac
-from cachetools import LRUCache, cached
+from cachetools import TTLCache, cached
+from prometheus_client import Counter
 
 DEFAULT_VAULT_URL = 'http://vault.vault:8200'
 DEFAULT_TOKEN_FILE_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/token'
 VAULT_ROLE = environ.get('VAULT_ROLE', '')
 VAULT_CREDENTIALS_KEY = environ.get('VAULT_CREDENTIALS_KEY', '')
 
+# credentials, and the S3 resource and connection pool built with them, are
+# replaced this often so that rotated credentials are picked up
+CREDENTIALS_TTL_SECONDS = int(environ.get('CREDENTIALS_TTL_SECONDS', 30 * 60))
 
-@cached(cache=LRUCache(maxsize=128))
+S3_RESOURCE_REQUESTS = Counter(
+    's3_resource_requests',
+    'Requests for an S3 resource, by whether a pooled resource was reused',
+    ['outcome']
+)
+
+# boto3 resources are not thread-safe, so each thread keeps its own
+_THREAD_LOCAL = threading.local()
+
+
+@cached(cache=TTLCache(maxsize=128, ttl=CREDENTIALS_TTL_SECONDS))
 def get_credentials(vault_role, vault_credentials_key, vault_url=DEFAULT_VAULT_URL, token_file_path=DEFAULT_TOKEN_FILE_PATH):
     if path.isfile(token_file_path):
         client = hvac.Client(vault_url)
@@ -26,6 +41,28 @@ def get_credentials(vault_role, vault_credentials_key, vault_url=DEFAULT_VAULT_U
 
 
 def authorized_s3_resource():
+    """
+    Provide an S3 resource for the calling thread, reusing the thread's
+    resource and its connection pool until its credentials are due to be
+    refreshed.
+    """
+    s3_resources = _thread_s3_resources()
+    s3 = s3_resources.get('s3')
+    if s3 is None:
+        s3 = s3_resources['s3'] = _new_s3_resource()
+        S3_RESOURCE_REQUESTS.labels(outcome='created').inc()
+    else:
+        S3_RESOURCE_REQUESTS.labels(outcome='reused').inc()
+    return s3
+
+
+def _thread_s3_resources() -> TTLCache:
+    if not hasattr(_THREAD_LOCAL, 's3_resources'):
+        _THREAD_LOCAL.s3_resources = TTLCache(maxsize=1, ttl=CREDENTIALS_TTL_SECONDS)
+    return _THREAD_LOCAL.s3_resources
+
+
+def _new_s3_resource():
     credentials = get_credentials(
         vault_role=VAULT_ROLE,
         vault_credentials_key=VAULT_CREDENTIALS_KEY
@@ -34,4 +71,4 @@ def authorized_s3_resource():
         max_pool_connections=50,
     )
     session = boto3.Session(**credentials)
-    return session.resource('s3', config=config)
\ No newline at end of file
+    return session.resource('s3', config=config)
@@ -8,6 +8,7 @@ import pytz
 DISCOVERY_API_QUERY_URL = 'https://data.smartcolumbusos.com/api/v1/query'
 
 MODEL_FILE_NAME = 'mlp_shortnorth_downtown_cluster.pkl'
+MODEL_ARTIFACT_FILE_NAME = 'parking_availability_model.artifact'
 
 DAY_OF_WEEK = Enum('DayOfWeek', ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY',
                                  'FRIDAY', 'SATURDAY', 'SUNDAY'], start=0)
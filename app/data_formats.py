@@ -4,7 +4,7 @@ from typing import List, Literal
 from pydantic import BaseModel, confloat, constr, validator
 
 from app.constants import PARK_MOBILE_SUPPLIER_ID
-from app.keeper_of_the_state import provide_zones
+from app.keeper_of_the_state import provide_zone_registry
 
 
 class APIPredictionRequest(BaseModel):
@@ -17,15 +17,10 @@ class APIPredictionRequest(BaseModel):
 
     @validator('zone_ids', pre=True, always=True)
     def all_zone_ids_are_valid(cls, zone_ids):
-        known_parking_locations = provide_zones()
+        zone_registry = provide_zone_registry()
         if zone_ids == 'All':
-            zone_ids = known_parking_locations
-        else:
-            zone_ids = sorted(
-                set(zone_ids).intersection(known_parking_locations),
-                key=zone_ids.index
-            )
-        return list(zone_ids)
+            return list(zone_registry.all)
+        return zone_registry.known(zone_ids)
 
 
 class APIPrediction(BaseModel):
@@ -0,0 +1,139 @@
+"""
+Responsible for locating times in the weekly parking enforcement calendar.
+
+Every enforced semihour of the week is a slot, numbered day by day from the
+start of enforcement on the first enforced day. Training data filters,
+model features and prediction requests all locate times by slot, so they
+agree on when parking is enforced.
+"""
+import datetime as dt
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.constants import DAY_OF_WEEK, HOURS_END, HOURS_GRACE_PERIOD, HOURS_START, UNENFORCED_DAYS
+
+ENFORCEMENT_DAYS = [day.value for day in DAY_OF_WEEK if day not in UNENFORCED_DAYS]
+TOTAL_ENFORCEMENT_DAYS = len(ENFORCEMENT_DAYS)
+
+MINUTES_AT_HOURS_START = 60 * HOURS_START.hour + HOURS_START.minute
+MINUTES_AT_HOURS_END = 60 * HOURS_END.hour + HOURS_END.minute
+TOTAL_SEMIHOURS = (MINUTES_AT_HOURS_END - MINUTES_AT_HOURS_START) // 30
+TOTAL_SLOTS = TOTAL_ENFORCEMENT_DAYS * TOTAL_SEMIHOURS
+
+#: The slot code of times when parking is not enforced.
+NOT_ENFORCED = -1
+
+# the enforcement day index of each day of the week, or NOT_ENFORCED
+_DAY_INDICES = np.array([
+    ENFORCEMENT_DAYS.index(weekday) if weekday in ENFORCEMENT_DAYS else NOT_ENFORCED
+    for weekday in range(len(DAY_OF_WEEK))
+])
+
+
+def slot_codes(timestamps) -> np.ndarray:
+    """
+    Locate many timestamps in the enforcement calendar at once.
+
+    Parameters
+    ----------
+    timestamps : array-like of datetime
+        The times to locate, e.g. a `pandas.Series` of them. Times with a time
+        zone are located by their local time.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        The slot code of each timestamp, or `NOT_ENFORCED`.
+    """
+    timestamps = pd.DatetimeIndex(timestamps)
+    day_indices = _DAY_INDICES[timestamps.dayofweek.to_numpy()]
+    semihours = (60 * timestamps.hour.to_numpy() + timestamps.minute.to_numpy() - MINUTES_AT_HOURS_START) // 30
+
+    is_enforced = (day_indices != NOT_ENFORCED) & (semihours >= 0) & (semihours < TOTAL_SEMIHOURS)
+    return np.where(is_enforced, day_indices * TOTAL_SEMIHOURS + semihours, NOT_ENFORCED)
+
+
+def slot_code(timestamp: dt.datetime) -> int:
+    """
+    Locate a timestamp in the enforcement calendar.
+
+    Parameters
+    ----------
+    timestamp : datetime.datetime
+        The time to locate.
+
+    Returns
+    -------
+    int
+        The slot code of `timestamp`, or `NOT_ENFORCED`.
+    """
+    day = day_index(timestamp)
+    semihour = semihour_index(timestamp)
+    if day == NOT_ENFORCED or semihour == NOT_ENFORCED:
+        return NOT_ENFORCED
+    return day * TOTAL_SEMIHOURS + semihour
+
+
+def slot_of(timestamp: dt.datetime) -> Optional[Tuple[int, int]]:
+    """
+    Locate a timestamp in the weekly enforcement grid.
+
+    Parameters
+    ----------
+    timestamp : datetime.datetime
+        The time to locate.
+
+    Returns
+    -------
+    tuple of (int, int) or None
+        The `(enforcement day, semihour)` indices of `timestamp`, or `None` if
+        parking is not enforced at that time.
+    """
+    code = slot_code(timestamp)
+    return None if code == NOT_ENFORCED else divmod(code, TOTAL_SEMIHOURS)
+
+
+def day_index(timestamp: dt.datetime) -> int:
+    """The index of a timestamp's day among enforced days, or `NOT_ENFORCED`."""
+    return int(_DAY_INDICES[timestamp.weekday()])
+
+
+def semihour_index(timestamp: dt.datetime) -> int:
+    """The index of a timestamp's semihour within enforced hours, or `NOT_ENFORCED`."""
+    semihour = (60 * timestamp.hour + timestamp.minute - MINUTES_AT_HOURS_START) // 30
+    return semihour if 0 <= semihour < TOTAL_SEMIHOURS else NOT_ENFORCED
+
+
+def is_enforced(timestamp: dt.datetime) -> bool:
+    """Whether parking is enforced at a given time."""
+    return slot_code(timestamp) != NOT_ENFORCED
+
+
+def adjust_for_grace_period(timestamp: dt.datetime) -> dt.datetime:
+    """
+    Move a timestamp within the grace period around enforced hours, when
+    parking can already or still be paid for, to the nearest enforced time.
+
+    Parameters
+    ----------
+    timestamp : datetime.datetime
+        The time to adjust.
+
+    Returns
+    -------
+    datetime.datetime
+        The start of enforcement if `timestamp` is up to `HOURS_GRACE_PERIOD`
+        before it, the end of enforcement if `timestamp` is up to
+        `HOURS_GRACE_PERIOD` after it, and otherwise `timestamp`.
+    """
+    hours_start = timestamp.replace(hour=HOURS_START.hour, minute=HOURS_START.minute, second=0, microsecond=0)
+    hours_end = timestamp.replace(hour=HOURS_END.hour, minute=HOURS_END.minute, second=0, microsecond=0)
+
+    if hours_start - HOURS_GRACE_PERIOD <= timestamp < hours_start:
+        return hours_start
+    elif hours_end < timestamp <= hours_end + HOURS_GRACE_PERIOD:
+        return hours_end
+    else:
+        return timestamp
@@ -1,15 +1,16 @@
 import asyncio
 import json
-from copy import deepcopy
 from datetime import datetime
 
 import backoff
 import websockets
 from dateutil import tz
+from prometheus_client import Gauge, Histogram
 
 import app.fybr.availability_tracker as fybr_availability_tracker
 from app.util import log_exception
 
+WEBSOCKET_URI = 'wss://streams.smartcolumbusos.com/socket/websocket'
 DATASET_STREAM_SYSTEM_NAME = 'fybr__short_north_parking_occupancy'
 JOIN_MESSAGE = json.dumps({
     'topic': f'streaming:{DATASET_STREAM_SYSTEM_NAME}',
@@ -18,13 +19,36 @@ JOIN_MESSAGE = json.dumps({
     'ref': '1'
 })
 
+MAX_BATCH_SIZE = 500
+MAX_BATCH_WAIT_SECONDS = 0.05
+MAX_QUEUED_MESSAGES = 10_000
+
+QUEUE_DEPTH = Gauge(
+    'fybr_message_queue_depth',
+    'Fybr messages received but not yet applied to the zone index',
+    multiprocess_mode='livesum'
+)
+BATCH_SIZE = Histogram(
+    'fybr_message_batch_size',
+    'Fybr messages applied to the zone index at once',
+    buckets=(1, 5, 10, 50, 100, 250, 500, float('inf'))
+)
+
+_END_OF_STREAM = object()
+
 
 class FybrAvailabilityProvider:
-    def __init__(self, uri, meter_and_zone_list):
+    def __init__(self, uri, meter_and_zone_list,
+                 max_batch_size=MAX_BATCH_SIZE,
+                 max_batch_wait_seconds=MAX_BATCH_WAIT_SECONDS,
+                 max_queued_messages=MAX_QUEUED_MESSAGES):
         zone_index, meter_index = fybr_availability_tracker.create_tracking_indices(meter_and_zone_list)
         self.uri = uri
         self.zone_index = zone_index
         self.meter_index = meter_index
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait_seconds = max_batch_wait_seconds
+        self.max_queued_messages = max_queued_messages
 
     @backoff.on_exception(
         backoff.expo, Exception, on_backoff=log_exception, max_value=60)
@@ -33,20 +57,59 @@ class FybrAvailabilityProvider:
             await websocket.send(JOIN_MESSAGE)
 
             handler = fybr_availability_tracker.create_message_handler(self.meter_index)
+            queue = asyncio.Queue(maxsize=self.max_queued_messages)
+            batch_applier = asyncio.ensure_future(self._apply_message_batches(queue, handler))
+
+            try:
+                async for message_string in websocket:
+                    if batch_applier.done():
+                        batch_applier.result()
+                    await queue.put(message_string)
+                    QUEUE_DEPTH.set(queue.qsize())
+
+                await queue.put(_END_OF_STREAM)
+                await batch_applier
+            finally:
+                batch_applier.cancel()
+
+    async def _apply_message_batches(self, queue, handler):
+        loop = asyncio.get_event_loop()
+        end_of_stream = False
+
+        while not end_of_stream:
+            batch = [await queue.get()]
+            flush_at = loop.time() + self.max_batch_wait_seconds
+
+            while len(batch) < self.max_batch_size and batch[-1] is not _END_OF_STREAM:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    time_left = flush_at - loop.time()
+                    if time_left <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), time_left))
+                    except asyncio.TimeoutError:
+                        break
+
+            end_of_stream = batch[-1] is _END_OF_STREAM
+            messages = [json.loads(message_string) for message_string in batch
+                        if message_string is not _END_OF_STREAM]
+            self.zone_index = handler(messages, self.zone_index)
+
+            QUEUE_DEPTH.set(queue.qsize())
+            BATCH_SIZE.observe(len(messages))
 
-            async for message_string in websocket:
-                message = json.loads(message_string)
-                self.zone_index = await asyncio.get_event_loop().run_in_executor(
-                    None, handler, [message], self.zone_index)
+            # let request handlers run between batches during bursts
+            await asyncio.sleep(0)
 
     def get_all_availability(self):
         availabilities = {}
         now = datetime.now(tz.tzutc())
-        zone_index = deepcopy(self.zone_index)
 
-        for zone_id in zone_index:
-            availability = fybr_availability_tracker.availability(zone_index, zone_id, now)
+        for zone_id in self.zone_index:
+            availability = fybr_availability_tracker.availability(self.zone_index, zone_id, now)
             if availability is not None:
                 availabilities[zone_id] = availability
 
-        return availabilities
\ No newline at end of file
+        return availabilities
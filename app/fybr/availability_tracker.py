@@ -1,33 +1,30 @@
 import datetime
 from collections import defaultdict
-from copy import deepcopy
 from functools import reduce
-from itertools import starmap
+from heapq import heapify, heappop, heappush
 from operator import itemgetter
 
 from dateutil import parser, tz
 
 INVALID_AFTER_MINUTES = 5
 
+UNSEEN_METER_STATUS = {'occupied': None, 'last_seen': None}
 
-def availability(zone_index, zone_id, timestamp):
-    def _too_old(_id, details):
-        last_seen = details['last_seen']
-        if not last_seen:
-            return True
-
-        cutoff = timestamp - datetime.timedelta(minutes=INVALID_AFTER_MINUTES)
 
-        return last_seen < cutoff
+def availability(zone_index, zone_id, timestamp):
+    zone = zone_index.get(zone_id)
+    if not zone:
+        return None
 
-    all_meters = zone_index.get(zone_id, {}).get('meters', {})
+    all_meters_count = len(zone['meters'])
+    if not all_meters_count or zone['known_count'] < all_meters_count:
+        return None
 
-    if not all_meters or any(starmap(_too_old, all_meters.items())):
+    cutoff = timestamp - datetime.timedelta(minutes=INVALID_AFTER_MINUTES)
+    if zone['oldest_last_seen'] < cutoff:
         return None
 
-    all_meters_count = len(all_meters)
-    available_meters = [m for m, d in all_meters.items() if not d['occupied']]
-    available_meters_count = len(available_meters)
+    available_meters_count = all_meters_count - zone['occupied_count']
 
     return round(available_meters_count / all_meters_count, 4)
 
@@ -47,28 +44,63 @@ def create_message_handler(meter_index):
         last_seen = parser.isoparse(record['time_of_ingest']).replace(tzinfo=tz.tzutc())
         occupied = record['occupancy'] == 'OCCUPIED'
 
-        index[zone_id]['meters'][meter_id] = {
+        zone = index[zone_id]
+        previous_status = zone['meters'].get(meter_id, UNSEEN_METER_STATUS)
+        zone['known_count'] += previous_status['last_seen'] is None
+        zone['occupied_count'] += occupied - bool(previous_status['occupied'])
+        zone['meters'][meter_id] = {
             'occupied': occupied,
             'last_seen': last_seen
         }
+        _track_last_seen(zone, meter_id, last_seen)
 
         return index
 
     def _handler(messages, zone_index):
-        return reduce(_reducer, messages, deepcopy(zone_index))
+        return reduce(_reducer, messages, zone_index)
 
     return _handler
 
 
+def _track_last_seen(zone, meter_id, last_seen):
+    """
+    Keep `oldest_last_seen` up to date using a min-heap of last seen times,
+    whose outdated entries are dropped once they reach the top.
+    """
+    meters = zone['meters']
+    last_seen_heap = zone['last_seen_heap']
+
+    heappush(last_seen_heap, (last_seen, meter_id))
+    while meters[last_seen_heap[0][1]]['last_seen'] != last_seen_heap[0][0]:
+        heappop(last_seen_heap)
+
+    if len(last_seen_heap) > 2 * len(meters):
+        last_seen_heap[:] = [(details['last_seen'], seen_meter_id)
+                             for seen_meter_id, details in meters.items()
+                             if details['last_seen'] is not None]
+        heapify(last_seen_heap)
+
+    zone['oldest_last_seen'] = last_seen_heap[0][0]
+
+
+def _untracked_zone():
+    return {
+        'meters': {},
+        'occupied_count': 0,
+        'known_count': 0,
+        'oldest_last_seen': None,
+        'last_seen_heap': []
+    }
+
+
 def create_tracking_indices(meter_and_zone_list):
     meter_index = {meter['meter_id']: meter['zone_id']
                    for meter in meter_and_zone_list}
 
-    zone_index = defaultdict(lambda: {'meters': {}})
-    default_meter_status = {'occupied': None, 'last_seen': None}
+    zone_index = defaultdict(_untracked_zone)
 
     get_zone_and_meter_ids = itemgetter('zone_id', 'meter_id')
     for zone_id, meter_id in map(get_zone_and_meter_ids, meter_and_zone_list):
-        zone_index[zone_id]['meters'][meter_id] = default_meter_status
+        zone_index[zone_id]['meters'][meter_id] = UNSEEN_METER_STATUS
 
     return zone_index, meter_index
@@ -0,0 +1,61 @@
+"""
+Responsible for running the ingestion process of a multi-worker deployment.
+It owns the Fybr websocket stream and the periodic model refresh, and
+publishes their results to the shared state directory for request workers.
+
+Run with `python -m app.ingest`.
+"""
+import asyncio
+import logging
+import os
+
+from prometheus_client import multiprocess
+
+from app import keeper_of_the_state, shared_state
+from app.fybr import zone_info
+from app.fybr.availability_provider import WEBSOCKET_URI, FybrAvailabilityProvider
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+async def ingest(directory):
+    os.makedirs(directory, exist_ok=True)
+    loop = asyncio.get_event_loop()
+
+    fybr_availability_provider = FybrAvailabilityProvider(WEBSOCKET_URI, zone_info.meter_and_zone_list())
+    fybr_availability_streamer = loop.create_task(fybr_availability_provider.handle_websocket_messages())
+
+    async def _publish_state():
+        await loop.run_in_executor(
+            None,
+            lambda state: shared_state.publish_state(directory, **state),
+            shared_state.current_state()
+        )
+        LOGGER.info(f'Published models and zones to {directory}')
+
+    async def _refresh_state_periodically():
+        while True:
+            await keeper_of_the_state.warm_caches()
+            # republished even when unchanged, so workers see how fresh it is
+            await _publish_state()
+            await asyncio.sleep(keeper_of_the_state.TTL_SECONDS)
+
+    if await keeper_of_the_state.restore_snapshot():
+        await _publish_state()
+    state_refresher = loop.create_task(_refresh_state_periodically())
+
+    try:
+        while True:
+            shared_state.publish_availability(directory, fybr_availability_provider.get_all_availability())
+            await asyncio.sleep(shared_state.PUBLISH_INTERVAL_SECONDS)
+    finally:
+        fybr_availability_streamer.cancel()
+        state_refresher.cancel()
+        if os.getenv('prometheus_multiproc_dir') is not None:
+            multiprocess.mark_process_dead(os.getpid())
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    asyncio.get_event_loop().run_until_complete(ingest(shared_state.SHARED_STATE_DIR))
@@ -1,45 +1,121 @@
 import asyncio
+import json
 import logging
 import os
 import pickle
+import socket
 import sys
-from datetime import date
+import tempfile
+from datetime import date, datetime
 from io import BytesIO
 from itertools import starmap
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
 
 import backoff
 import botocore
 import requests
+from boto3.s3.transfer import TransferConfig
+from pydantic import ValidationError
 
-from app import auth_provider
-from app.constants import DISCOVERY_API_QUERY_URL, MODEL_FILE_NAME
+from app import auth_provider, model_artifact
+from app.constants import (DISCOVERY_API_QUERY_URL, MODEL_ARTIFACT_FILE_NAME,
+                           MODEL_FILE_NAME)
 from app.util import log_exception
 
 if TYPE_CHECKING:
     from app.model import ParkingAvailabilityModel
+    from app.prediction_table import PredictionTable
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 if sys.stdout.isatty():
     LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
-TTL_HOURS = 12
-TTL_SECONDS = TTL_HOURS * 60 * 60
+TTL_SECONDS = int(os.environ.get('MODEL_REFRESH_SECONDS', 10 * 60))
+ZONE_DISCOVERY_TIMEOUT_SECONDS = 30
 
 MODELS_DIR_ROOT = 'models'
 MODELS_DIR_LATEST = f'{MODELS_DIR_ROOT}/latest'
+MODEL_CACHE_DIR = os.environ.get(
+    'MODEL_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'parking-prediction-models')
+)
+
+SNAPSHOT_FILE_NAME = 'snapshot.json'
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_MB', 2048)) * 1024 ** 2
+
+# models larger than a part are downloaded as concurrent ranged GETs
+MODEL_DOWNLOAD_PART_SIZE = int(os.environ.get('MODEL_DOWNLOAD_PART_SIZE_MB', 8)) * 1024 ** 2
+MODEL_DOWNLOAD_CONCURRENCY = int(os.environ.get('MODEL_DOWNLOAD_CONCURRENCY', 10))
+DOWNLOAD_CONFIG = TransferConfig(
+    multipart_threshold=MODEL_DOWNLOAD_PART_SIZE,
+    multipart_chunksize=MODEL_DOWNLOAD_PART_SIZE,
+    max_concurrency=MODEL_DOWNLOAD_CONCURRENCY
+)
+
+
+class ZoneRegistry:
+    """The parking zones known to exist, indexed for fast validation."""
+
+    def __init__(self, zone_ids: Iterable[str] = ()):
+        self.all = tuple(dict.fromkeys(zone_ids))
+        self.ordinals = {zone_id: ordinal for ordinal, zone_id in enumerate(self.all)}
+
+    def __contains__(self, zone_id) -> bool:
+        return zone_id in self.ordinals
+
+    def __len__(self) -> int:
+        return len(self.all)
+
+    def known(self, zone_ids: Iterable[str]) -> List[str]:
+        """
+        Filter zone IDs down to known zones.
+
+        Parameters
+        ----------
+        zone_ids : iterable of str
+            The zone IDs to filter.
+
+        Returns
+        -------
+        list of str
+            The known zones among `zone_ids`, in their original order and
+            without duplicates.
+        """
+        ordinals = self.ordinals
+        return [zone_id for zone_id in dict.fromkeys(zone_ids) if zone_id in ordinals]
+
 
 MODELS = {}
-ZONES = []
+MODEL_VERSIONS = {}
+MODEL_ETAGS = {}
+STATE_CHECKED_AT = None
+PREDICTION_TABLES = {}
+ZONE_REGISTRY = ZoneRegistry()
 
 
 def provide_model(model_tag='latest') -> Optional['ParkingAvailabilityModel']:
     return MODELS.get(model_tag, None)
 
 
-def provide_zones() -> List[str]:
-    return ZONES
+def provide_model_version(model_tag='latest') -> int:
+    return MODEL_VERSIONS.get(model_tag, 0)
+
+
+def provide_prediction_table(model_tag='latest') -> Optional['PredictionTable']:
+    return PREDICTION_TABLES.get(model_tag, None)
+
+
+def provide_zones() -> Tuple[str, ...]:
+    return ZONE_REGISTRY.all
+
+
+def provide_zone_registry() -> ZoneRegistry:
+    return ZONE_REGISTRY
+
+
+def provide_state_checked_at() -> Optional[datetime]:
+    return STATE_CHECKED_AT
 
 
 def warm_caches_synchronously(extra_model_tags=[]):
@@ -54,71 +130,333 @@ def historical_model_name(model_date):
 
 @backoff.on_exception(backoff.expo, Exception, on_backoff=log_exception)
 async def warm_caches(extra_model_tags=[]):
-    model_tags = ['latest'] + get_comparative_models() + extra_model_tags
-    model_fetches = [_fetch_all(model_tag) for model_tag in model_tags]
+    """
+    Fetch the models and known zones, skipping the download of models whose
+    ETag has not changed since they were last fetched, and save a snapshot
+    of them to restore on startup.
+
+    Returns
+    -------
+    bool
+        Whether any model or the known zones changed.
+    """
+    global STATE_CHECKED_AT
 
-    fetched_models = await asyncio.gather(*model_fetches)
+    model_tags = ['latest'] + get_comparative_models() + extra_model_tags
+    model_fetches = [_fetch_all(model_tag, MODEL_ETAGS.get(model_tag)) for model_tag in model_tags]
+
+    fetched_models = [
+        (tag, model, model_etag)
+        for tag, model, model_etag in await asyncio.gather(*model_fetches)
+        if model is not None
+    ]
+    prediction_tables = await asyncio.gather(*[
+        asyncio.get_event_loop().run_in_executor(None, _build_prediction_table, model)
+        for _tag, model, _model_etag in fetched_models
+    ])
+    zone_ids = await asyncio.get_event_loop().run_in_executor(None, _fetch_zone_ids)
+
+    changed = bool(fetched_models) or tuple(zone_ids) != provide_zones()
+    if changed:
+        install_state(
+            {tag: model for tag, model, _model_etag in fetched_models},
+            {tag: prediction_table
+             for (tag, _model, _model_etag), prediction_table in zip(fetched_models, prediction_tables)},
+            zone_ids
+        )
+        MODEL_ETAGS.update({tag: model_etag for tag, _model, model_etag in fetched_models})
+    else:
+        LOGGER.debug('Models and zones are unchanged')
+    STATE_CHECKED_AT = datetime.now()
+
+    _save_snapshot()
+    return changed
+
+
+async def restore_snapshot():
+    """
+    Serve the models and zones saved by the last successful `warm_caches`,
+    as long as the models are still in the model cache. A snapshot that can
+    not be restored, e.g. because it or a cached model is corrupt, is deleted
+    along with the models it refers to, and left for `warm_caches` to replace.
+
+    Returns
+    -------
+    bool
+        Whether a snapshot was restored.
+    """
+    snapshot_path = os.path.join(MODEL_CACHE_DIR, SNAPSHOT_FILE_NAME)
+    try:
+        with open(snapshot_path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        LOGGER.exception(f'Deleting unreadable snapshot {snapshot_path}')
+        os.remove(snapshot_path)
+        return False
 
-    for tag, model in fetched_models:
+    try:
+        return await _restore_snapshot(snapshot)
+    except Exception:
+        LOGGER.exception(f'Failed to restore snapshot {snapshot_path}, deleting it and the models it refers to')
+        _delete_snapshot(snapshot_path, snapshot)
+        return False
+
+
+async def _restore_snapshot(snapshot):
+    def _load_snapshot_models():
+        models, prediction_tables = {}, {}
+        for tag, model_etag in snapshot['model_etags'].items():
+            model_format, _path, etag = model_etag
+            local_path = _cached_model_path(model_format, etag)
+            if os.path.exists(local_path):
+                models[tag] = _load_cached_model(model_format, local_path)
+                prediction_tables[tag] = _build_prediction_table(models[tag])
+        return models, prediction_tables
+
+    models, prediction_tables = await asyncio.get_event_loop().run_in_executor(None, _load_snapshot_models)
+    if not models:
+        return False
+
+    install_state(models, prediction_tables, snapshot['zone_ids'],
+                  checked_at=datetime.fromisoformat(snapshot['checked_at']))
+    MODEL_ETAGS.update({tag: tuple(snapshot['model_etags'][tag]) for tag in models})
+    LOGGER.info(f'Restored models {sorted(models)} from the snapshot taken at {STATE_CHECKED_AT}')
+    return True
+
+
+def _delete_snapshot(snapshot_path, snapshot):
+    cached_model_paths = []
+    try:
+        cached_model_paths = [_cached_model_path(model_format, etag)
+                              for model_format, _path, etag in snapshot['model_etags'].values()]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+
+    for path in [snapshot_path, *cached_model_paths]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _save_snapshot():
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    snapshot_path = os.path.join(MODEL_CACHE_DIR, SNAPSHOT_FILE_NAME)
+    temporary_path = _download_path(snapshot_path)
+    with open(temporary_path, 'w') as snapshot_file:
+        json.dump({
+            'model_etags': MODEL_ETAGS,
+            'zone_ids': provide_zones(),
+            'checked_at': STATE_CHECKED_AT.isoformat()
+        }, snapshot_file)
+    os.replace(temporary_path, snapshot_path)
+
+
+def install_state(models, prediction_tables, zone_ids, model_versions=None, checked_at=None):
+    """
+    Replace the models, prediction tables and known zones being served.
+
+    Parameters
+    ----------
+    models : dict of {str : app._models.abstract_model.Model}
+        The models to serve, by model tag.
+    prediction_tables : dict of {str : app.prediction_table.PredictionTable}
+        The prediction tables for `models`, by model tag. Tags whose table is
+        `None` or missing are served by evaluating their model.
+    zone_ids : iterable of str
+        The parking zones known to exist.
+    model_versions : dict of {str : int}, optional
+        The version of each model tag. By default, the version of every tag in
+        `models`, and of every other tag if the known zones changed, is
+        incremented.
+    checked_at : datetime.datetime, optional
+        When the state was last checked against its sources. The default is
+        now.
+    """
+    global STATE_CHECKED_AT, ZONE_REGISTRY
+
+    model_versions = model_versions or {}
+    zone_registry = ZoneRegistry(zone_ids)
+
+    for tag, model in models.items():
         MODELS[tag] = model or {}
+        MODEL_VERSIONS[tag] = model_versions.get(tag, provide_model_version(tag) + 1)
+        if prediction_tables.get(tag) is None:
+            PREDICTION_TABLES.pop(tag, None)
+        else:
+            PREDICTION_TABLES[tag] = prediction_tables[tag]
+
+    # every model's predictions cover the known zones, so they change with them
+    if zone_registry.all != ZONE_REGISTRY.all:
+        for tag in MODELS.keys() - models.keys():
+            MODEL_VERSIONS[tag] = model_versions.get(tag, provide_model_version(tag) + 1)
 
-    ZONES.clear()
-    ZONES.extend(_fetch_zone_ids())
+    ZONE_REGISTRY = zone_registry
+    STATE_CHECKED_AT = checked_at or datetime.now()
 
 
 async def fetch_state_periodically():
     while True:
-        await asyncio.sleep(TTL_SECONDS)
         await warm_caches()
+        await asyncio.sleep(TTL_SECONDS)
 
 
-async def _fetch_all(model_tag):
-    bucket = await asyncio.get_event_loop().run_in_executor(None, _bucket_for_environment)
+async def _fetch_all(model_tag, known_model_etag=None):
+    """
+    Fetch a model, unless it is the one identified by `known_model_etag`.
 
-    model_key = f'{MODELS_DIR_ROOT}/{model_tag}/{MODEL_FILE_NAME}'
+    Returns
+    -------
+    tuple of (str, app._models.abstract_model.Model or None, tuple)
+        The model tag, the model (or `None` if it is unchanged or no model
+        file exists) and the format, path and ETag identifying it.
+    """
+    bucket = await asyncio.get_event_loop().run_in_executor(None, _bucket_for_environment)
 
-    async def _check_exists(cluster_id, path):
-        return cluster_id, path, await asyncio.get_event_loop().run_in_executor(None, _model_exists_at_path, bucket, path)
+    async def _check_exists(model_format, path):
+        return model_format, path, await asyncio.get_event_loop().run_in_executor(None, _model_etag_at_path, bucket, path)
 
     def _filter_exists(path_tuple):
-        _, _, exists = path_tuple
-        return exists
-
-    async def _model_download(id, path, _exists):
-        return await asyncio.get_event_loop().run_in_executor(None, _fetch_model, id, bucket, path)
+        _, _, model_etag = path_tuple
+        return model_etag is not None
 
-    model_paths = [('irrelevant, unused id', model_key)]
+    async def _model_download(model_format, path, model_etag):
+        return await asyncio.get_event_loop().run_in_executor(None, _fetch_model, model_format, bucket, path, model_etag)
 
-    model_exists_futures = list(starmap(_check_exists, model_paths))
+    model_exists_futures = list(starmap(_check_exists, _model_paths(model_tag)))
     model_exists = await asyncio.gather(*model_exists_futures)
-    existing_model_paths = filter(_filter_exists, model_exists)
+    preferred_existing_model_paths = list(filter(_filter_exists, model_exists))[:1]
+
+    if not preferred_existing_model_paths:
+        LOGGER.warning(f'No model file found for {model_tag}, keeping the model being served')
+        return model_tag, None, known_model_etag
+
+    model_etags = [tuple(path_tuple) for path_tuple in preferred_existing_model_paths]
+    if model_etags == [known_model_etag]:
+        LOGGER.debug(f'Model {model_tag} is unchanged')
+        return model_tag, None, known_model_etag
 
-    model_futures = list(starmap(_model_download, existing_model_paths))
+    model_futures = list(starmap(_model_download, preferred_existing_model_paths))
     models = await asyncio.gather(*model_futures)
 
-    return model_tag, models[0]
+    return model_tag, models[0], model_etags[0]
+
+
+def fetch_latest_model():
+    """
+    Fetch the most recently archived model, e.g. to update it with new data.
+
+    Returns
+    -------
+    app._models.abstract_model.Model or None
+        The latest model, or `None` if no model has been archived.
+    """
+    bucket = _bucket_for_environment()
+    for model_format, path in _model_paths('latest'):
+        model_etag = _model_etag_at_path(bucket, path)
+        if model_etag is not None:
+            return _fetch_model(model_format, bucket, path, model_etag)
+    return None
 
 
-def _model_exists_at_path(bucket, path):
+def _model_paths(model_tag):
+    return [
+        ('artifact', f'{MODELS_DIR_ROOT}/{model_tag}/{MODEL_ARTIFACT_FILE_NAME}'),
+        ('pickle', f'{MODELS_DIR_ROOT}/{model_tag}/{MODEL_FILE_NAME}')
+    ]
+
+
+def _build_prediction_table(model):
+    if not getattr(model, 'weekly_periodic', False):
+        return None
+
+    # imported here because building features depends on this module
+    from app.prediction_table import PredictionTable
+    try:
+        return PredictionTable.build(model)
+    except ValidationError:
+        # e.g. compared models that take other features than app.model's
+        LOGGER.warning(f'Serving {type(model).__name__} without a prediction table, '
+                       'since it does not accept the current model features')
+        return None
+
+
+def _model_etag_at_path(bucket, path):
     try:
         LOGGER.debug(f'checking if model exists at {path}')
-        bucket.Object(path).load()
+        model_object = bucket.Object(path)
+        model_object.load()
         LOGGER.debug(f'done checking model exists at {path}')
-        return True
+        return model_object.e_tag
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
-            return False
+            return None
         else:
             raise e
 
 
-def _fetch_model(id, bucket, model_path):
-    LOGGER.debug(f'Fetching model: {model_path}')
-    with BytesIO() as in_memory_file:
-        bucket.download_fileobj(model_path, in_memory_file)
-        in_memory_file.seek(0)
+def _fetch_model(model_format, bucket, model_path, model_etag):
+    local_path = _cached_model_path(model_format, model_etag)
+
+    if os.path.exists(local_path):
+        LOGGER.debug(f'Using cached model for {model_path}')
+        os.utime(local_path)
+    else:
+        LOGGER.debug(f'Fetching model: {model_path}')
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+
+        # replaced rather than overwritten, so models already mapped from an
+        # earlier download are left intact
+        download_path = _download_path(local_path)
+        bucket.download_file(model_path, download_path, Config=DOWNLOAD_CONFIG)
+        os.replace(download_path, local_path)
         LOGGER.debug(f'Done fetching model {model_path}')
-        return pickle.load(in_memory_file)
+
+        _evict_cached_models(keep=local_path)
+
+    return _load_cached_model(model_format, local_path)
+
+
+def _download_path(path):
+    # the cache may be shared by the pods on a node, whose process ids overlap
+    return f'{path}.{socket.gethostname()}.{os.getpid()}.download'
+
+
+def _cached_model_path(model_format, model_etag):
+    # cached by content, so copies of a model under several keys are
+    # downloaded once and survive restarts while the cache directory does
+    etag = model_etag.strip('"')
+    return os.path.join(MODEL_CACHE_DIR, f'{etag}.{model_format}')
+
+
+def _load_cached_model(model_format, local_path):
+    if model_format == 'pickle':
+        with open(local_path, 'rb') as model_file:
+            return pickle.load(model_file)
+    return model_artifact.load_model(local_path)
+
+
+def _evict_cached_models(keep):
+    """
+    Remove the least recently used models from the model cache until it fits
+    in `MODEL_CACHE_MAX_BYTES`, keeping the model at path `keep`.
+    """
+    cached_models = []
+    for entry in os.scandir(MODEL_CACHE_DIR):
+        if entry.is_file() and entry.name != SNAPSHOT_FILE_NAME and not entry.name.endswith('.download'):
+            stat = entry.stat()
+            cached_models.append((stat.st_mtime, stat.st_size, entry.path))
+
+    cache_size = sum(size for _mtime, size, _path in cached_models)
+    for _mtime, size, path in sorted(cached_models):
+        if cache_size <= MODEL_CACHE_MAX_BYTES:
+            break
+        if path != keep:
+            LOGGER.debug(f'Evicting cached model {path}')
+            os.remove(path)
+            cache_size -= size
 
 
 def archive_model(model):
@@ -129,11 +467,20 @@ def archive_model(model):
     _delete_models_in_path(bucket, dated_path)
     _delete_models_in_path(bucket, MODELS_DIR_LATEST)
 
-    model_serialized = pickle.dumps(model)
+    # the pickle is written even alongside an artifact, for pods that predate
+    # the artifact format during rolling deploys
+    serialized_models = {MODEL_FILE_NAME: pickle.dumps(model)}
+    try:
+        with BytesIO() as artifact:
+            model_artifact.dump_model(model, artifact)
+            serialized_models[MODEL_ARTIFACT_FILE_NAME] = artifact.getvalue()
+    except TypeError:
+        LOGGER.info('Model state can not be memory-mapped, archiving it as a pickle only')
 
-    LOGGER.info(f'Loading {MODEL_FILE_NAME} into {bucket.name}')
-    bucket.put_object(Body=model_serialized, Key=f'{MODELS_DIR_LATEST}/{MODEL_FILE_NAME}')
-    bucket.put_object(Body=model_serialized, Key=f'{dated_path}/{MODEL_FILE_NAME}')
+    for model_file_name, model_serialized in serialized_models.items():
+        LOGGER.info(f'Loading {model_file_name} into {bucket.name}')
+        bucket.put_object(Body=model_serialized, Key=f'{MODELS_DIR_LATEST}/{model_file_name}')
+        bucket.put_object(Body=model_serialized, Key=f'{dated_path}/{model_file_name}')
 
 
 def _delete_models_in_path(bucket, path):
@@ -157,8 +504,13 @@ def _fetch_zone_ids():
     data = ('SELECT DISTINCT "pm zone number" '
             'FROM city_of_columbus__columbus_parking_meters')
 
-    with requests.post(DISCOVERY_API_QUERY_URL, data=data) as response:
-        return sorted(response.text.strip().split('\n')[1:])
+    try:
+        with requests.post(DISCOVERY_API_QUERY_URL, data=data, timeout=ZONE_DISCOVERY_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            return sorted(response.text.strip().split('\n')[1:])
+    except requests.RequestException as e:
+        LOGGER.warning(f'Keeping the known zones, since they could not be discovered: {e}')
+        return list(provide_zones())
 
 
 def get_comparative_models():
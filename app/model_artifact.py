@@ -0,0 +1,165 @@
+"""
+Responsible for the model artifact format, which stores a model's state as a
+JSON header followed by the raw buffers of its arrays. Artifacts are read by
+memory-mapping them, so loading a model does not copy or unpickle its arrays
+and processes loading the same artifact share its pages.
+
+Layout::
+
+    MAGIC | header length (uint64, little-endian) | JSON header | padding
+          | array buffers, each aligned to ALIGNMENT bytes
+"""
+import importlib
+import json
+import mmap
+import struct
+from typing import BinaryIO, Mapping, Tuple
+
+import numpy as np
+
+MAGIC = b'PARKMDL\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write(file: BinaryIO, header: Mapping, arrays: Mapping[str, np.ndarray]) -> None:
+    """
+    Write a header and a set of arrays in the artifact format.
+
+    Parameters
+    ----------
+    file : binary file-like object
+        Where to write the artifact.
+    header : dict
+        JSON-serializable metadata to store alongside the arrays.
+    arrays : dict of {str : numpy.ndarray}
+        The arrays to store. Arrays of Python objects are not supported.
+
+    Raises
+    ------
+    TypeError
+        If `header` is not JSON-serializable or an array holds Python objects.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise TypeError(f'Array {name} holds Python objects, which can not be memory-mapped')
+        layout[name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+
+    encoded_header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'header': header,
+        'arrays': layout
+    }).encode()
+
+    prefix = MAGIC + _HEADER_LENGTH.pack(len(encoded_header)) + encoded_header
+    file.write(prefix + bytes(_aligned(len(prefix)) - len(prefix)))
+
+    position = 0
+    for name, array in arrays.items():
+        file.write(bytes(layout[name]['offset'] - position))
+        file.write(array.data)
+        position = layout[name]['offset'] + array.nbytes
+
+
+def read(path: str) -> Tuple[dict, Mapping[str, np.ndarray]]:
+    """
+    Memory-map an artifact.
+
+    Parameters
+    ----------
+    path : str
+        The location of the artifact on disk.
+
+    Returns
+    -------
+    tuple of (dict, dict of {str : numpy.ndarray})
+        The artifact's header and its read-only arrays, which are backed by
+        the mapped file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not an artifact in a supported format version.
+    """
+    with open(path, 'rb') as file:
+        mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped_file[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a model artifact')
+
+    header_start = len(MAGIC) + _HEADER_LENGTH.size
+    header_length, = _HEADER_LENGTH.unpack_from(mapped_file, len(MAGIC))
+    metadata = json.loads(mapped_file[header_start:header_start + header_length])
+    if metadata['format_version'] != FORMAT_VERSION:
+        raise ValueError(f'{path} has unsupported format version {metadata["format_version"]}')
+
+    data_start = _aligned(header_start + header_length)
+    arrays = {
+        name: np.frombuffer(
+            mapped_file,
+            dtype=np.dtype(details['dtype']),
+            count=int(np.prod(details['shape'])),
+            offset=data_start + details['offset']
+        ).reshape(details['shape'])
+        for name, details in metadata['arrays'].items()
+    }
+    return metadata['header'], arrays
+
+
+def dump_model(model, file: BinaryIO) -> None:
+    """
+    Write a model in the artifact format.
+
+    Parameters
+    ----------
+    model : app._models.abstract_model.Model
+        The model to write. Its state must consist of NumPy arrays and
+        JSON-serializable values.
+    file : binary file-like object
+        Where to write the artifact.
+
+    Raises
+    ------
+    TypeError
+        If the model's state can not be stored in the artifact format.
+    """
+    state = model.__getstate__()
+    arrays = {key: value for key, value in state.items() if isinstance(value, np.ndarray)}
+    header = {
+        'model': f'{type(model).__module__}:{type(model).__qualname__}',
+        'state': {key: value for key, value in state.items() if key not in arrays}
+    }
+    write(file, header, arrays)
+
+
+def load_model(path: str):
+    """
+    Load a model from an artifact without copying its arrays.
+
+    Parameters
+    ----------
+    path : str
+        The location of the artifact on disk.
+
+    Returns
+    -------
+    app._models.abstract_model.Model
+    """
+    header, arrays = read(path)
+
+    module_name, class_name = header['model'].split(':')
+    model_class = getattr(importlib.import_module(module_name), class_name)
+
+    model = model_class.__new__(model_class)
+    model.__setstate__({**header['state'], **arrays})
+    return model
@@ -0,0 +1,185 @@
+"""
+Responsible for keeping a local copy of the `parking_zone_occupancy_aggr`
+table that models are trained on, so that repeated training runs and
+notebooks can read it in seconds instead of querying SQL Server.
+
+Occupancy is stored as Parquet files partitioned by month and parking zone,
+
+    <directory>/month=2020-09/zone=<quoted zone name>/part-0.parquet
+
+and a refresh only re-reads the months that may have changed since the
+previous one. Writing Parquet needs `pyarrow` (or `fastparquet`), so check
+`available()` before using the cache.
+"""
+import json
+import logging
+import os
+import shutil
+from typing import Callable, Iterable, Iterator, List, Optional
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MANIFEST_FILE_NAME = 'cache.json'
+STAGING_DIR_NAME = '.refresh'
+
+# rows for the day before a refresh may still have been aggregating
+REFRESH_OVERLAP = pd.Timedelta(days=1)
+
+
+def available() -> bool:
+    """Whether a Parquet engine is installed, so that the cache can be used."""
+    try:
+        pd.io.parquet.get_engine('auto')
+    except ImportError:
+        return False
+    return True
+
+
+def refresh(directory: str,
+            read_occupancy: Callable[[pd.Timestamp], Iterable[pd.DataFrame]],
+            since: pd.Timestamp) -> None:
+    """
+    Bring the cache up to date, reading only the months that are missing from
+    it or may have changed since it was last refreshed, and removing months
+    before `since`.
+
+    Parameters
+    ----------
+    directory : str
+        The cache directory.
+    read_occupancy : callable
+        Reads occupancy from the database, one chunk at a time, given the time
+        to read it from.
+    since : pandas.Timestamp
+        The earliest time the cache should hold occupancy for.
+    """
+    os.makedirs(directory, exist_ok=True)
+    refreshed_at = pd.Timestamp.utcnow().tz_localize(None)
+
+    cached_months = _cached_months(directory)
+    missing_months = [month for month in pd.period_range(since, refreshed_at, freq='M')
+                      if month not in cached_months]
+
+    manifest = _read_manifest(directory)
+    if manifest is not None:
+        stale_month = pd.Period(pd.Timestamp(manifest['refreshed_at']) - REFRESH_OVERLAP, freq='M')
+    else:
+        stale_month = cached_months[-1] if cached_months else None
+
+    refresh_from = min(month for month in [stale_month, *missing_months[:1]] if month is not None)
+    LOGGER.info(f'Refreshing cached occupancy from {refresh_from} in {directory}')
+
+    staging_dir = os.path.join(directory, STAGING_DIR_NAME)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    rows_cached = 0
+    for part, occupancy_chunk in enumerate(read_occupancy(refresh_from.start_time)):
+        occupancy_chunk = occupancy_chunk.astype({'semihour': 'datetime64[ns]'})
+        months = occupancy_chunk.semihour.dt.to_period('M')
+        for (month, zone_id), partition in occupancy_chunk.groupby([months, 'zone_name'], sort=False):
+            partition_dir = os.path.join(staging_dir, _partition_dir_name(month, zone_id))
+            os.makedirs(partition_dir, exist_ok=True)
+            partition.to_parquet(os.path.join(partition_dir, f'part-{part}.parquet'), index=False)
+        rows_cached += len(occupancy_chunk)
+
+    for month in cached_months:
+        if month >= refresh_from or month < pd.Period(since, freq='M'):
+            shutil.rmtree(os.path.join(directory, _month_dir_name(month)))
+    if os.path.isdir(staging_dir):
+        for month_dir_name in os.listdir(staging_dir):
+            os.replace(os.path.join(staging_dir, month_dir_name), os.path.join(directory, month_dir_name))
+        os.rmdir(staging_dir)
+
+    with open(os.path.join(directory, MANIFEST_FILE_NAME), 'w') as manifest_file:
+        json.dump({'refreshed_at': refreshed_at.isoformat()}, manifest_file)
+    LOGGER.info(f'Cached {rows_cached} rows of occupancy')
+
+
+def read_chunks(directory: str,
+                columns: Optional[List[str]] = None,
+                since: Optional[pd.Timestamp] = None,
+                zone_ids: Optional[Iterable[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read cached occupancy one month at a time.
+
+    Parameters
+    ----------
+    directory : str
+        The cache directory.
+    columns : list of str, optional
+        The columns to read. By default, every column is read.
+    since : pandas.Timestamp, optional
+        The earliest time to read occupancy for.
+    zone_ids : iterable of str, optional
+        The parking zones to read occupancy for. By default, every zone's
+        occupancy is read.
+
+    Yields
+    ------
+    pandas.DataFrame
+        The occupancy for one month.
+    """
+    zone_ids = None if zone_ids is None else set(zone_ids)
+    read_columns = columns
+    if columns is not None and since is not None and 'semihour' not in columns:
+        read_columns = [*columns, 'semihour']
+
+    for month in _cached_months(directory):
+        if since is not None and month.end_time < since:
+            continue
+
+        month_dir = os.path.join(directory, _month_dir_name(month))
+        partitions = [
+            pd.read_parquet(os.path.join(month_dir, zone_dir_name, part_file_name), columns=read_columns)
+            for zone_dir_name in sorted(os.listdir(month_dir))
+            if zone_ids is None or unquote(zone_dir_name[len('zone='):]) in zone_ids
+            for part_file_name in sorted(os.listdir(os.path.join(month_dir, zone_dir_name)))
+        ]
+        if not partitions:
+            continue
+
+        occupancy = pd.concat(partitions, ignore_index=True)
+        if since is not None:
+            occupancy = occupancy.loc[occupancy.semihour >= since]
+        yield occupancy if columns is None else occupancy.loc[:, columns]
+
+
+def read(directory: str,
+         columns: Optional[List[str]] = None,
+         since: Optional[pd.Timestamp] = None,
+         zone_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Read cached occupancy into one data frame, e.g. in a notebook. See
+    `read_chunks` for the parameters.
+    """
+    return pd.concat(read_chunks(directory, columns, since, zone_ids), ignore_index=True)
+
+
+def _cached_months(directory) -> List[pd.Period]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        pd.Period(dir_name[len('month='):], freq='M')
+        for dir_name in os.listdir(directory)
+        if dir_name.startswith('month=')
+    )
+
+
+def _month_dir_name(month) -> str:
+    return f'month={month}'
+
+
+def _partition_dir_name(month, zone_id) -> str:
+    return os.path.join(_month_dir_name(month), f'zone={quote(str(zone_id), safe="")}')
+
+
+def _read_manifest(directory) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
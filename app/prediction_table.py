@@ -0,0 +1,130 @@
+"""
+Responsible for precomputing a model's availability predictions for every
+parking zone at every enforced semihour of the week, so that prediction
+requests can be answered with a table lookup instead of a model evaluation.
+"""
+import math
+from datetime import date, datetime, time, timedelta
+from typing import BinaryIO, Iterable, Mapping, Optional, Sequence
+
+import numpy as np
+
+from app import model_artifact
+from app.constants import HOURS_START
+from app.data_formats import APIPredictionRequest
+from app.enforcement_calendar import ENFORCEMENT_DAYS, TOTAL_ENFORCEMENT_DAYS, TOTAL_SEMIHOURS, slot_of
+from app.model import ModelFeatures
+
+
+class PredictionTable:
+    """
+    A model's predictions for a set of parking zones at every semihour of the
+    weekly enforcement grid.
+    """
+
+    def __init__(self, zone_ids: Sequence[str], availabilities: np.ndarray):
+        self.zone_ids = tuple(zone_ids)
+        self._zone_rows = {zone_id: row for row, zone_id in enumerate(self.zone_ids)}
+        self._availabilities = availabilities
+
+    @classmethod
+    def build(cls, model, zone_ids: Optional[Iterable[str]] = None) -> 'PredictionTable':
+        """
+        Evaluate a model at every semihour of the weekly enforcement grid.
+
+        Parameters
+        ----------
+        model : app._models.abstract_model.Model
+            A model whose predictions only depend on the day of week and
+            semihour being predicted.
+        zone_ids : iterable of str, optional
+            The zones to tabulate. The default is every zone the model
+            supports.
+
+        Returns
+        -------
+        PredictionTable
+        """
+        zone_ids = list(model.supported_zones if zone_ids is None else zone_ids)
+        table = cls(zone_ids, np.full((len(zone_ids), TOTAL_ENFORCEMENT_DAYS, TOTAL_SEMIHOURS), np.nan))
+        start_of_enforcement = time(HOURS_START.hour, HOURS_START.minute)
+
+        monday = date.today() - timedelta(days=date.today().weekday())
+        slots = [
+            (day, semihour, datetime.combine(monday + timedelta(days=weekday), start_of_enforcement)
+                            + timedelta(minutes=30 * semihour))
+            for day, weekday in enumerate(ENFORCEMENT_DAYS)
+            for semihour in range(TOTAL_SEMIHOURS)
+        ]
+        slot_predictions = model.predict_batches(
+            ModelFeatures.from_request(
+                APIPredictionRequest.construct(timestamp=timestamp, zone_ids=zone_ids)
+            )
+            for _day, _semihour, timestamp in slots
+        )
+
+        for (day, semihour, _timestamp), predictions in zip(slots, slot_predictions):
+            for zone_id, availability in predictions.items():
+                table._availabilities[table._zone_rows[zone_id], day, semihour] = availability
+
+        return table
+
+    def dump(self, file: BinaryIO) -> None:
+        """
+        Write the table in the model artifact format.
+
+        Parameters
+        ----------
+        file : binary file-like object
+            Where to write the table.
+        """
+        model_artifact.write(file, {'zone_ids': self.zone_ids}, {'availabilities': self._availabilities})
+
+    @classmethod
+    def load(cls, path: str) -> 'PredictionTable':
+        """
+        Memory-map a table written by `dump`.
+
+        Parameters
+        ----------
+        path : str
+            The location of the table on disk.
+
+        Returns
+        -------
+        PredictionTable
+        """
+        header, arrays = model_artifact.read(path)
+        return cls(header['zone_ids'], arrays['availabilities'])
+
+    def lookup(self, timestamp: datetime, zone_ids: Iterable[str]) -> Mapping[str, float]:
+        """
+        Look up the tabulated predictions for some zones at a given time.
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime
+            The date and time to look up predictions for.
+        zone_ids : iterable of str
+            The parking zones to look up, in the order they should be
+            returned.
+
+        Returns
+        -------
+        dict of {str : float}
+            A mapping of zone IDs to predicted availability. Zones without a
+            prediction are left out.
+        """
+        slot = slot_of(timestamp)
+        if slot is None:
+            return {}
+
+        day, semihour = slot
+        found_zone_ids = [zone_id for zone_id in zone_ids if zone_id in self._zone_rows]
+        rows = [self._zone_rows[zone_id] for zone_id in found_zone_ids]
+        availabilities = self._availabilities[rows, day, semihour].tolist()
+        return {
+            zone_id: availability
+            for zone_id, availability in zip(found_zone_ids, availabilities)
+            if not math.isnan(availability)
+        }
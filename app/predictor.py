@@ -1,8 +1,8 @@
-import pandas as pd
 from pydantic import ValidationError
 
-from app import keeper_of_the_state
-from app.data_formats import APIPrediction, APIPredictionRequest
+from app import enforcement_calendar, keeper_of_the_state
+from app.constants import PARK_MOBILE_SUPPLIER_ID
+from app.data_formats import APIPredictionRequest
 from app.model import ModelFeatures
 
 
@@ -29,43 +29,146 @@ def predict(input_datetime, zone_ids='All', model_tag='latest'):
         A mapping of zone IDs to their predicted parking availability
         values. Parking availability is expressed as a ratio of available
         parking spots to total parking spots in each zone, represented as a
-        float between 0 and 1.
+        float between 0 and 1. It is empty until the model has been loaded.
     """
-    if not during_hours_of_operation(input_datetime):
+    if not (during_hours_of_operation(input_datetime) and keeper_of_the_state.provide_model(model_tag)):
         predictions = {}
     else:
         try:
-            predictions = keeper_of_the_state.provide_model(model_tag).predict(
-                ModelFeatures.from_request(
-                    APIPredictionRequest(
-                        timestamp=input_datetime,
-                        zone_ids=zone_ids
-                    )
-                )
+            request = APIPredictionRequest(
+                timestamp=input_datetime,
+                zone_ids=zone_ids
             )
+            prediction_table = keeper_of_the_state.provide_prediction_table(model_tag)
+            if prediction_table is not None:
+                predictions = prediction_table.lookup(request.timestamp, request.zone_ids)
+            else:
+                predictions = keeper_of_the_state.provide_model(model_tag).predict(
+                    ModelFeatures.from_request(request)
+                )
         except ValidationError as e:
             predictions = {}
     return predictions
 
 
+def predict_many(input_datetimes, zone_ids='All', model_tag='latest'):
+    """
+    Predict the availability of parking in parking zones at several times,
+    evaluating the model for all of them at once.
+
+    Parameters
+    ----------
+    input_datetimes : iterable of datetime.datetime
+        The dates and times at which parking meter availability should be
+        predicted.
+    zone_ids : str or collection of hashable, optional
+        The parking zones where availability estimates are being requested.
+        The default is 'All', which will result in availability predictions
+        for all parking zones.
+    model_tag : str, optional
+        The identifier of the model parameters to use (default: 'latest').
+
+    Yields
+    ------
+    dict of {str : float}
+        The predictions for each of `input_datetimes`, in order, as returned
+        by `predict`.
+    """
+    input_datetimes = list(input_datetimes)
+    model = keeper_of_the_state.provide_model(model_tag)
+    if not model:
+        yield from ({} for _ in input_datetimes)
+        return
+    try:
+        zone_ids = APIPredictionRequest(zone_ids=zone_ids).zone_ids
+    except ValidationError as e:
+        yield from ({} for _ in input_datetimes)
+        return
+
+    prediction_table = keeper_of_the_state.provide_prediction_table(model_tag)
+    if prediction_table is not None:
+        for input_datetime in input_datetimes:
+            yield prediction_table.lookup(input_datetime, zone_ids)
+        return
+
+    operating_datetimes = [input_datetime for input_datetime in input_datetimes
+                           if during_hours_of_operation(input_datetime)]
+    operating_predictions = iter(model.predict_batches(
+        ModelFeatures.from_request(
+            APIPredictionRequest.construct(timestamp=input_datetime, zone_ids=zone_ids)
+        )
+        for input_datetime in operating_datetimes
+    ))
+    for input_datetime in input_datetimes:
+        yield next(operating_predictions) if during_hours_of_operation(input_datetime) else {}
+
+
 def during_hours_of_operation(input_datetime):
-    return input_datetime.weekday() < 6 and 8 <= input_datetime.hour < 22
+    return enforcement_calendar.is_enforced(input_datetime)
 
 
 def predict_with(models, input_datetime, zone_ids='All'):
-    return pd.DataFrame(
-        data={model: predict(input_datetime, zone_ids, model)
-              for model in models}
-    ).rename(
-        columns=lambda model_tag: f'{model_tag}Prediction'
-    ).assign(
-        zoneId=[zone_id
-                for zone_id in APIPredictionRequest(zone_ids=zone_ids).zone_ids
-                if any(
-                    zone_id in keeper_of_the_state.provide_model(model).supported_zones
-                    for model in models
-                )]
-    ).to_dict('records')
+    """
+    Compare the predictions of several models at a given time.
+
+    The request is validated, and model features are built, once for all of
+    the models.
+
+    Parameters
+    ----------
+    models : list of str
+        The identifiers of the models to compare.
+    input_datetime : datetime.datetime
+        The date and time at which parking meter availability should be
+        predicted.
+    zone_ids : str or collection of hashable, optional
+        The parking zones where availability estimates are being requested.
+        The default is 'All', which will result in availability predictions
+        for all parking zones.
+
+    Returns
+    -------
+    list of dict of {str : str or float or None}
+        One record per requested zone that any of the models supports, in the
+        order requested. Each record has the `zoneId` and a
+        `<model>Prediction` for every model, which is `None` if that model
+        has no prediction for the zone.
+    """
+    if not during_hours_of_operation(input_datetime):
+        return []
+    try:
+        request = APIPredictionRequest(timestamp=input_datetime, zone_ids=zone_ids)
+    except ValidationError as e:
+        return []
+
+    features = None
+    model_predictions = []
+    supported_zones = set()
+    for model_tag in models:
+        model = keeper_of_the_state.provide_model(model_tag)
+        if not model:
+            model_predictions.append({})
+            continue
+
+        prediction_table = keeper_of_the_state.provide_prediction_table(model_tag)
+        if prediction_table is not None:
+            model_predictions.append(prediction_table.lookup(request.timestamp, request.zone_ids))
+        else:
+            if features is None:
+                features = ModelFeatures.from_request(request)
+            model_predictions.append(model.predict(features))
+        supported_zones |= model.supported_zone_set
+
+    prediction_columns = [(f'{model_tag}Prediction', predictions)
+                          for model_tag, predictions in zip(models, model_predictions)]
+    return [
+        {
+            'zoneId': zone_id,
+            **{column: predictions.get(zone_id) for column, predictions in prediction_columns}
+        }
+        for zone_id in request.zone_ids
+        if zone_id in supported_zones
+    ]
 
 
 def predict_formatted(input_datetime, zone_ids='All', model='latest'):
@@ -103,6 +206,9 @@ def to_api_format(predictions):
     """
     Transform a dictionary of predictions into a list of outputs in API format.
 
+    The records are built directly rather than through `APIPrediction`, since
+    model predictions are already known to be ratios between 0 and 1.
+
     Parameters
     ----------
     predictions : dict of {str : float}
@@ -120,9 +226,10 @@ def to_api_format(predictions):
     APIPrediction : Defines the current prediction API record format
     """
     return [
-        APIPrediction(
-            zoneId=zone_id,
-            availabilityPrediction=availability
-        ).dict()
+        {
+            'zoneId': zone_id,
+            'availabilityPrediction': round(availability, 4),
+            'supplierID': PARK_MOBILE_SUPPLIER_ID
+        }
         for zone_id, availability in predictions.items()
     ]
@@ -0,0 +1,88 @@
+"""
+Responsible for caching serialized prediction responses for all parking zones,
+which only change once per semihour, when models are refreshed, or when live
+sensor data overrides a prediction.
+"""
+import json
+from datetime import datetime
+from typing import Iterable, Mapping
+
+from cachetools import LRUCache
+
+from app import keeper_of_the_state, predictor
+
+CACHED_SEMIHOURS = 4
+
+_SERIALIZED_PREDICTIONS = LRUCache(maxsize=CACHED_SEMIHOURS)
+
+
+class SerializedPredictions:
+    """Predictions in API format, serialized one JSON record per zone."""
+
+    def __init__(self, predictions: Mapping[str, float]):
+        records = predictor.to_api_format(predictions)
+        self._zone_positions = {record['zoneId']: position
+                                for position, record in enumerate(records)}
+        self._serialized_records = [_serialize(record) for record in records]
+        self.body = _join(self._serialized_records)
+
+    def patched(self, known_availabilities: Mapping[str, float]) -> bytes:
+        """
+        Serialize the predictions with some zones' values replaced.
+
+        Parameters
+        ----------
+        known_availabilities : dict of {str : float}
+            Known availability for zones, e.g. from live sensors. Zones
+            without a prediction are ignored.
+
+        Returns
+        -------
+        bytes
+            The JSON response body.
+        """
+        overridden_zone_ids = known_availabilities.keys() & self._zone_positions.keys()
+        if not overridden_zone_ids:
+            return self.body
+
+        serialized_records = list(self._serialized_records)
+        for record in predictor.to_api_format({zone_id: known_availabilities[zone_id]
+                                               for zone_id in overridden_zone_ids}):
+            serialized_records[self._zone_positions[record['zoneId']]] = _serialize(record)
+        return _join(serialized_records)
+
+
+def all_zone_predictions(timestamp: datetime, known_availabilities: Mapping[str, float]) -> bytes:
+    """
+    Provide the serialized predictions for all parking zones during the
+    semihour containing a given time.
+
+    Parameters
+    ----------
+    timestamp : datetime.datetime
+        The date and time at which parking availability should be predicted.
+    known_availabilities : dict of {str : float}
+        Known availability for zones, which takes precedence over predictions.
+
+    Returns
+    -------
+    bytes
+        The JSON response body, a list of predictions in API format.
+    """
+    semihour = timestamp.replace(minute=30 * (timestamp.minute // 30), second=0, microsecond=0)
+    cache_key = (keeper_of_the_state.provide_model_version('latest'), semihour)
+
+    serialized_predictions = _SERIALIZED_PREDICTIONS.get(cache_key)
+    if serialized_predictions is None:
+        serialized_predictions = SerializedPredictions(predictor.predict(semihour))
+        _SERIALIZED_PREDICTIONS[cache_key] = serialized_predictions
+
+    return serialized_predictions.patched(known_availabilities)
+
+
+def _serialize(record) -> bytes:
+    return json.dumps(record, sort_keys=True, separators=(',', ':')).encode()
+
+
+def _join(serialized_records: Iterable[bytes]) -> bytes:
+    return b'[' + b','.join(serialized_records) + b']'
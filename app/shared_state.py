@@ -0,0 +1,347 @@
+"""
+Responsible for sharing state between the ingestion process, which streams
+Fybr availability and refreshes models, and the request workers, which serve
+what it publishes.
+
+State is published as files in a directory that workers memory-map, so every
+worker on a host reads the same copy of the models, prediction tables and
+zone availability.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from collections.abc import Mapping
+from datetime import datetime
+from io import BytesIO
+from typing import Optional, Sequence
+from urllib.parse import quote
+
+import numpy as np
+
+from app import keeper_of_the_state, model_artifact
+from app.fybr.availability_tracker import INVALID_AFTER_MINUTES
+from app.prediction_table import PredictionTable
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+SHARED_STATE_DIR = os.environ.get('SHARED_STATE_DIR') or None
+PUBLISH_INTERVAL_SECONDS = float(os.environ.get('SHARED_STATE_PUBLISH_INTERVAL_SECONDS', 1))
+
+MANIFEST_FILE_NAME = 'state.json'
+AVAILABILITY_FILE_NAME = 'availability.artifact'
+
+
+class SharedAvailability(Mapping):
+    """Zone availability backed by a memory-mapped array."""
+
+    def __init__(self, zone_ids: Sequence[str], availabilities: np.ndarray):
+        self._zone_positions = {zone_id: position for position, zone_id in enumerate(zone_ids)}
+        self._availabilities = availabilities
+
+    def __getitem__(self, zone_id) -> float:
+        return float(self._availabilities[self._zone_positions[zone_id]])
+
+    def __iter__(self):
+        return iter(self._zone_positions)
+
+    def __len__(self) -> int:
+        return len(self._zone_positions)
+
+    def keys(self):
+        return self._zone_positions.keys()
+
+
+_NO_AVAILABILITY = SharedAvailability([], np.empty(0))
+
+
+class SharedAvailabilityProvider:
+    """
+    Provides the zone availability published by the ingestion process, in
+    place of a `FybrAvailabilityProvider`. Like Fybr availability itself, it
+    is ignored once it is older than `INVALID_AFTER_MINUTES`, e.g. because
+    the ingestion process died.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, AVAILABILITY_FILE_NAME)
+        self._file_stamp = None
+        self._published_at = None
+        self._availabilities = _NO_AVAILABILITY
+
+    def get_all_availability(self) -> Mapping:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return _NO_AVAILABILITY
+
+        file_stamp = (stat.st_ino, stat.st_mtime_ns)
+        if file_stamp != self._file_stamp:
+            header, arrays = model_artifact.read(self.path)
+            self._availabilities = SharedAvailability(header['zone_ids'], arrays['availabilities'])
+            self._published_at = header.get('published_at')
+            self._file_stamp = file_stamp
+
+        if self._published_at is None or time.time() - self._published_at > 60 * INVALID_AFTER_MINUTES:
+            return _NO_AVAILABILITY
+        return self._availabilities
+
+
+def publish_availability(directory: str, availabilities: Mapping) -> None:
+    """
+    Publish zone availability for request workers to read.
+
+    Parameters
+    ----------
+    directory : str
+        The shared state directory.
+    availabilities : dict of {str : float}
+        The known availability of each parking zone.
+    """
+    def _write(file):
+        model_artifact.write(
+            file,
+            {'zone_ids': list(availabilities.keys()), 'published_at': time.time()},
+            {'availabilities': np.fromiter(availabilities.values(), dtype=np.float64, count=len(availabilities))}
+        )
+
+    _replace_atomically(os.path.join(directory, AVAILABILITY_FILE_NAME), _write)
+
+
+def current_state() -> dict:
+    """
+    Take a snapshot of the state being served by this process, which can be
+    published from another thread.
+
+    Returns
+    -------
+    dict
+        The keyword arguments for `publish_state`.
+    """
+    return {
+        'models': dict(keeper_of_the_state.MODELS),
+        'prediction_tables': dict(keeper_of_the_state.PREDICTION_TABLES),
+        'zone_ids': keeper_of_the_state.provide_zones(),
+        'checked_at': keeper_of_the_state.provide_state_checked_at()
+    }
+
+
+def publish_state(directory: str, models, prediction_tables, zone_ids, checked_at=None) -> None:
+    """
+    Publish models, prediction tables and known zones for request workers to
+    load.
+
+    Files are named by their content, and the version of each model is the
+    generation of the state it last changed in. Generations increase from the
+    previously published state, so they keep increasing when the ingestion
+    process restarts.
+
+    Files that neither this nor the previously published state refer to are
+    removed, so workers that are still loading the previous state can finish.
+
+    Parameters
+    ----------
+    directory : str
+        The shared state directory.
+    models : dict of {str : app._models.abstract_model.Model}
+        The models to publish, by model tag.
+    prediction_tables : dict of {str : app.prediction_table.PredictionTable}
+        The prediction tables for `models`, by model tag.
+    zone_ids : iterable of str
+        The parking zones known to exist.
+    checked_at : datetime.datetime, optional
+        When the state was last checked against its sources.
+    """
+    previous_manifest = _read_manifest(directory) or {'models': {}}
+    generation = 1 + max([
+        previous_manifest.get('generation', 0),
+        *(files['version'] for files in previous_manifest['models'].values())
+    ])
+    manifest = {
+        'generation': generation,
+        'zone_ids': list(zone_ids),
+        'checked_at': checked_at.isoformat() if checked_at else None,
+        'models': {}
+    }
+    # every model's predictions cover the known zones, so they change with them
+    zones_changed = manifest['zone_ids'] != previous_manifest.get('zone_ids')
+
+    for tag, model in models.items():
+        files = {
+            'model': _publish_model(directory, tag, model),
+            'prediction_table': _publish_prediction_table(directory, tag, prediction_tables.get(tag))
+        }
+        previous_files = previous_manifest['models'].get(tag)
+        unchanged = (not zones_changed and previous_files is not None and
+                     all(previous_files[kind] == file_name for kind, file_name in files.items()))
+        files['version'] = previous_files['version'] if unchanged else generation
+        manifest['models'][tag] = files
+
+    _replace_atomically(
+        os.path.join(directory, MANIFEST_FILE_NAME),
+        lambda file: file.write(json.dumps(manifest).encode())
+    )
+
+    published_file_names = {MANIFEST_FILE_NAME, AVAILABILITY_FILE_NAME} | {
+        file_name
+        for published in [manifest, previous_manifest]
+        for files in published['models'].values()
+        for file_name in [files['model'], files['prediction_table']]
+        if file_name is not None
+    }
+    for file_name in os.listdir(directory):
+        if file_name not in published_file_names and not file_name.endswith('.tmp'):
+            os.remove(os.path.join(directory, file_name))
+
+
+def load_published_state(directory: str) -> Optional[dict]:
+    """
+    Load the most recently published state. Models and prediction tables in
+    the artifact format are memory-mapped rather than copied.
+
+    Parameters
+    ----------
+    directory : str
+        The shared state directory.
+
+    Returns
+    -------
+    dict or None
+        The keyword arguments for `keeper_of_the_state.install_state`, or
+        `None` if no state has been published yet.
+    """
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        return None
+
+    models, model_versions, prediction_tables = {}, {}, {}
+    for tag, files in manifest['models'].items():
+        model_versions[tag] = files['version']
+        if files['version'] == keeper_of_the_state.provide_model_version(tag):
+            models[tag] = keeper_of_the_state.provide_model(tag)
+            prediction_tables[tag] = keeper_of_the_state.provide_prediction_table(tag)
+        else:
+            models[tag] = _load_model(directory, files['model'])
+            prediction_tables[tag] = (PredictionTable.load(os.path.join(directory, files['prediction_table']))
+                                      if files['prediction_table'] is not None else None)
+
+    return {
+        'models': models,
+        'prediction_tables': prediction_tables,
+        'zone_ids': manifest['zone_ids'],
+        'model_versions': model_versions,
+        'checked_at': datetime.fromisoformat(manifest['checked_at']) if manifest.get('checked_at') else None
+    }
+
+
+async def wait_for_published_state(directory: str):
+    """
+    Wait until published state has been installed in this process, so that
+    a request worker does not serve before it has models and zones.
+
+    Returns
+    -------
+    tuple
+        Identifies the version of the published state that was installed,
+        for `follow_published_state`.
+    """
+    LOGGER.info(f'Waiting for models and zones to be published to {directory}')
+    manifest_stamp = None
+    while manifest_stamp is None:
+        manifest_stamp = await _install_published_state(directory, manifest_stamp)
+        if manifest_stamp is None:
+            await asyncio.sleep(PUBLISH_INTERVAL_SECONDS)
+    return manifest_stamp
+
+
+async def follow_published_state(directory: str, manifest_stamp=None):
+    """
+    Install newly published state in this process as it appears. State that
+    fails to load, e.g. because it was pruned while being read, is retried on
+    the next poll.
+    """
+    while True:
+        manifest_stamp = await _install_published_state(directory, manifest_stamp)
+        await asyncio.sleep(PUBLISH_INTERVAL_SECONDS)
+
+
+async def _install_published_state(directory, manifest_stamp):
+    """Install the published state unless it is the one `manifest_stamp` identifies."""
+    try:
+        stat = os.stat(os.path.join(directory, MANIFEST_FILE_NAME))
+    except FileNotFoundError:
+        return manifest_stamp
+
+    latest_manifest_stamp = (stat.st_ino, stat.st_mtime_ns)
+    if latest_manifest_stamp == manifest_stamp:
+        return manifest_stamp
+
+    try:
+        state = await asyncio.get_event_loop().run_in_executor(None, load_published_state, directory)
+        keeper_of_the_state.install_state(**state)
+    except Exception:
+        LOGGER.exception('Failed to load published models and zones, retrying')
+        return manifest_stamp
+
+    LOGGER.info('Loaded published models and zones')
+    return latest_manifest_stamp
+
+
+def _publish_model(directory, tag, model) -> Optional[str]:
+    if not model:
+        return None
+
+    try:
+        with BytesIO() as artifact:
+            model_artifact.dump_model(model, artifact)
+            return _publish_file(directory, tag, 'model.artifact', artifact.getvalue())
+    except TypeError:
+        return _publish_file(directory, tag, 'model.pickle', pickle.dumps(model))
+
+
+def _publish_prediction_table(directory, tag, prediction_table) -> Optional[str]:
+    if prediction_table is None:
+        return None
+
+    with BytesIO() as artifact:
+        prediction_table.dump(artifact)
+        return _publish_file(directory, tag, 'table.artifact', artifact.getvalue())
+
+
+def _publish_file(directory, tag, kind, content: bytes) -> str:
+    # named by content, so a file that exists already holds it
+    file_name = f'{quote(tag, safe="")}-{hashlib.sha256(content).hexdigest()[:16]}.{kind}'
+    path = os.path.join(directory, file_name)
+    if not os.path.exists(path):
+        _replace_atomically(path, lambda file: file.write(content))
+    return file_name
+
+
+def _load_model(directory, file_name):
+    if file_name is None:
+        return {}
+
+    path = os.path.join(directory, file_name)
+    if file_name.endswith('.pickle'):
+        with open(path, 'rb') as model_file:
+            return pickle.load(model_file)
+    return model_artifact.load_model(path)
+
+
+def _read_manifest(directory) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def _replace_atomically(path, write):
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        write(file)
+    os.replace(temporary_path, path)
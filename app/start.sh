@@ -1,17 +1,39 @@
 #!/usr/bin/env bash
 service nginx start
+
+export WORKERS="${WORKERS:-1}"
+# every worker, and the ingestion process, writes its metrics here for /metrics to collect
+export prometheus_multiproc_dir="${prometheus_multiproc_dir:-/tmp/parking-prediction-metrics}"
+mkdir -p "$prometheus_multiproc_dir"
+chmod 1777 "$prometheus_multiproc_dir"
+if [ "$WORKERS" -gt 1 ]; then
+    # workers share the models and availability published by one ingestion process
+    export SHARED_STATE_DIR="${SHARED_STATE_DIR:-/tmp/parking-prediction-state}"
+fi
+
 (
 cd /
 su www-data -s /bin/bash -pc '
+if [ -n "$SHARED_STATE_DIR" ] && [ -z "$SHARED_STATE_INGEST_SIDECAR" ]; then
+    # restart the ingestion process whenever it exits; on Kubernetes it runs
+    # in a sidecar container with its own liveness probe instead
+    (
+    while true; do
+        python -m app.ingest
+        echo "Ingestion process exited with status $?, restarting" >&2
+        sleep 5
+    done
+    ) &
+fi
 hypercorn \
         --user $(id -u www-data) \
         --group $(id -g www-data) \
         --umask "0022" \
-        --workers 1 \
+        --workers $WORKERS \
         --bind unix:/tmp/hypercorn.sock \
         --error-logfile - \
         --access-logfile - \
         --config file:/app/hypercorn_config.py \
         app:app
 '
-)
\ No newline at end of file
+)
@@ -5,26 +5,54 @@ predictions for all parking zones in Columbus, at all times of day, for thirty
 days before and after today's date.
 """
 import argparse
-import csv
+import logging
+import sys
 from datetime import date, datetime, timedelta
+from itertools import repeat
 from os import environ
 
+import pandas as pd
+from boto3.s3.transfer import TransferConfig
+
 from app import auth_provider, keeper_of_the_state, predictor
+from app.constants import PARK_MOBILE_SUPPLIER_ID
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+if sys.stdout.isatty():
+    LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
 LOCAL_FILE_NAME = "report.csv"
 S3_FILE_NAME = "reports/parking_predictions_daily.csv"
+LOCAL_PARQUET_FILE_NAME = "report.parquet"
+S3_PARQUET_FILE_NAME = "reports/parking_predictions_daily.parquet"
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 ** 2,
+    multipart_chunksize=8 * 1024 ** 2,
+    max_concurrency=10
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--model", help=f"The model to report on. Defaults to the current day's model: {keeper_of_the_state.historical_model_name(date.today())}")
 
 
-def _annotate_predictions(predictions, date, report_time, model):
-    for prediction in predictions:
-        prediction["time"] = date
-        prediction["report_time"] = report_time
-        prediction["model"] = model
+def _report_frame(semihours, predictions_by_semihour, report_time, model):
+    zone_ids, availabilities, times = [], [], []
+    for semihour, predictions in zip(semihours, predictions_by_semihour):
+        zone_ids.extend(predictions.keys())
+        availabilities.extend(predictions.values())
+        times.extend(repeat(datetime.strftime(semihour, TIME_FORMAT), len(predictions)))
 
-    return predictions
+    return pd.DataFrame({
+        'zoneId': zone_ids,
+        'availabilityPrediction': pd.Series(availabilities, dtype=float).round(4),
+        'time': times,
+        'report_time': report_time,
+        'model': model,
+        'supplierID': PARK_MOBILE_SUPPLIER_ID
+    })
 
 
 def _bucket_for_environment():
@@ -43,24 +71,18 @@ if __name__ == "__main__":
     keeper_of_the_state.warm_caches_synchronously([model])
 
     bucket = _bucket_for_environment()
-    bucket.delete_objects(Delete={'Objects': [{"Key": S3_FILE_NAME}]})
+    bucket.delete_objects(Delete={'Objects': [{"Key": S3_FILE_NAME}, {"Key": S3_PARQUET_FILE_NAME}]})
 
     window_start = _beginning_of_day(datetime.now() - timedelta(days=30))
     window_end = _beginning_of_day(datetime.now() + timedelta(days=30))
 
-    semihour_cursor = window_start
-    report_run = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
-
-    with open(LOCAL_FILE_NAME, mode='w') as csv_file:
-        fieldnames = ['zoneId', 'availabilityPrediction', 'time', 'report_time', 'model', 'supplierID']
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        writer.writeheader()
-        while semihour_cursor < window_end:
-            semihour_cursor = semihour_cursor + timedelta(minutes=30)
-            prediction_output = predictor.predict_formatted(semihour_cursor, 'All', model)
-            _annotate_predictions(prediction_output, datetime.strftime(semihour_cursor, "%Y-%m-%d %H:%M:%S"), report_run, model)
-            if prediction_output:
-                for prediction in prediction_output:
-                    writer.writerow(prediction)
-
-    bucket.upload_file(LOCAL_FILE_NAME, S3_FILE_NAME, ExtraArgs={'ACL':'public-read'})
+    semihours = pd.date_range(window_start + timedelta(minutes=30), window_end, freq='30min').to_pydatetime()
+    report_run = datetime.strftime(datetime.now(), TIME_FORMAT)
+
+    report = _report_frame(semihours, predictor.predict_many(semihours, 'All', model), report_run, model)
+
+    report.to_csv(LOCAL_FILE_NAME, index=False)
+    bucket.upload_file(LOCAL_FILE_NAME, S3_FILE_NAME, ExtraArgs={'ACL':'public-read'}, Config=UPLOAD_CONFIG)
+
+    report.to_parquet(LOCAL_PARQUET_FILE_NAME, index=False)
+    bucket.upload_file(LOCAL_PARQUET_FILE_NAME, S3_PARQUET_FILE_NAME, ExtraArgs={'ACL':'public-read'}, Config=UPLOAD_CONFIG)
@@ -29,6 +29,19 @@ ALL_VALID_ZONE_IDS = [
 ]
 
 
+def pytest_addoption(parser):
+    parser.addoption('--benchmarks', action='store_true', help='also run tests marked as benchmarks')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='benchmarks only run with --benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture(scope='function')
 def mocked_scos_zone_ids_query():
     with responses.RequestsMock() as rsps:
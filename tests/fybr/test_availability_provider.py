@@ -137,6 +137,32 @@ async def test_recovers_from_errors(event_loop):
                 }
 
 
+@pytest.mark.asyncio
+async def test_applies_every_message_when_batches_are_small(event_loop):
+    uri='ws://localhost:5001/socket/websocket'
+    meter_and_zone_list = [
+        {'meter_id': f'98{meter}', 'zone_id': '0001'}
+        for meter in range(10, 20)
+    ]
+    availability_provider = FybrAvailabilityProvider(uri, meter_and_zone_list,
+                                                     max_batch_size=3,
+                                                     max_queued_messages=2)
+
+    messages = [
+        update_event({'id': f'98{meter}', 'occupancy': 'OCCUPIED' if meter % 2 else 'UNOCCUPIED', 'time_of_ingest': '2020-05-21T18:00:00.000000'})
+        for meter in range(10, 20)
+    ]
+
+    fake_server = create_fake_server(messages=messages)
+    async with websockets.serve(fake_server, '127.0.0.1', 5001):
+        await availability_provider.handle_websocket_messages()
+
+        with freeze_time('2020-05-21T18:05:00.000000'):
+            assert availability_provider.get_all_availability() == {
+                '0001': 0.5
+            }
+
+
 @asynccontextmanager
 async def fake_websocket_failure(url):
     def _raise_on_send(message):
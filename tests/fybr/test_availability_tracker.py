@@ -1,41 +1,22 @@
+import logging
+import time
+from copy import deepcopy
+
+import pytest
+
 import app.fybr.availability_tracker as fybr_availability_tracker
 from tests.util import as_ts
 
+LOGGER = logging.getLogger(__name__)
 
-def test_handler_reduces_applicable_messages_into_index():
-    meter_index = {
-        '9860': '0001',
-        '9861': '0001',
-        '9862': '0002',
-        '9863': '0002'
-    }
 
-    zone_index = {
-        '0001': {
-            'meters': {
-                '9860': {
-                    'occupied': None,
-                    'last_seen': None
-                },
-                '9861': {
-                    'occupied': None,
-                    'last_seen': None
-                }
-            }
-        },
-        '0002': {
-            'meters': {
-                '9862': {
-                    'occupied': None,
-                    'last_seen': None
-                },
-                '9863': {
-                    'occupied': None,
-                    'last_seen': None
-                }
-            }
-        }
-    }
+def test_handler_reduces_applicable_messages_into_index():
+    zone_index, meter_index = fybr_availability_tracker.create_tracking_indices([
+        {'meter_id': '9860', 'zone_id': '0001'},
+        {'meter_id': '9861', 'zone_id': '0001'},
+        {'meter_id': '9862', 'zone_id': '0002'},
+        {'meter_id': '9863', 'zone_id': '0002'}
+    ])
 
     messages = [
         {'event': 'update', 'payload': {'id': '9861', 'limit': 'no-limit', 'occupancy': 'OCCUPIED', 'time_of_ingest': '2020-05-21T18:00:00.037201'}},
@@ -51,90 +32,145 @@ def test_handler_reduces_applicable_messages_into_index():
 
     zone_index = message_handler(messages, zone_index)
 
-    assert zone_index == {
+    assert {zone_id: zone['meters'] for zone_id, zone in zone_index.items()} == {
         '0001': {
-            'meters': {
-                '9860': {
-                    'occupied': None,
-                    'last_seen': None
-                },
-                '9861': {
-                    'occupied': False,
-                    'last_seen': as_ts('2020-05-21T18:01:00.037202')
-                }
-            }
-        },
-        '0002': {
-            'meters': {
-                '9862': {
-                    'occupied': True,
-                    'last_seen': as_ts('2020-05-21T18:01:00.037201')
-                },
-                '9863': {
-                    'occupied': False,
-                    'last_seen': as_ts('2020-05-21T18:01:00.037202')
-                }
-            }
-        }
-    }
-
-
-def test_availability_returns_valid_availability_for_zone_and_timestamp():
-    timestamp_to_test = as_ts('2020-05-21T17:15:01.000000')
-
-    zone_that_is_valid_because_all_data_is_within_last_15_minutes = {
-        'meters': {
-            '9864': {
-                'occupied': True,
-                'last_seen': as_ts('2020-05-21T17:14:00.032202')
-            },
-            '9865': {
-                'occupied': False,
-                'last_seen': as_ts('2020-05-21T17:12:00.037202')
+            '9860': {
+                'occupied': None,
+                'last_seen': None
             },
-            '9866': {
+            '9861': {
                 'occupied': False,
-                'last_seen': as_ts('2020-05-21T17:11:00.037202')
+                'last_seen': as_ts('2020-05-21T18:01:00.037202')
             }
-        }
-    }
-    zone_that_is_invalid_because_it_has_old_meter_data = {
-        'meters': {
+        },
+        '0002': {
             '9862': {
                 'occupied': True,
-                'last_seen': as_ts('2020-05-21T17:00:00.000000')
+                'last_seen': as_ts('2020-05-21T18:01:00.037201')
             },
             '9863': {
-                'occupied': False,
-                'last_seen': as_ts('2020-05-21T16:01:00.037202')
-            }
-        }
-    }
-    zone_that_is_invalid_because_it_has_not_seen_a_meter = {
-        'meters': {
-            '9860': {
-                'occupied': None,
-                'last_seen': None
-            },
-            '9861': {
                 'occupied': False,
                 'last_seen': as_ts('2020-05-21T18:01:00.037202')
             }
         }
     }
-    zone_that_is_invalid_because_it_has_no_meters = {
-        'meters': {}
-    }
 
-    zone_index = {
-        '0001': zone_that_is_invalid_because_it_has_not_seen_a_meter,
-        '0002': zone_that_is_invalid_because_it_has_old_meter_data,
-        '0003': zone_that_is_valid_because_all_data_is_within_last_15_minutes,
-        '0004': zone_that_is_invalid_because_it_has_no_meters
-    }
+    assert zone_index['0001']['occupied_count'] == 0
+    assert zone_index['0001']['known_count'] == 1
+    assert zone_index['0001']['oldest_last_seen'] == as_ts('2020-05-21T18:01:00.037202')
+
+    assert zone_index['0002']['occupied_count'] == 1
+    assert zone_index['0002']['known_count'] == 2
+    assert zone_index['0002']['oldest_last_seen'] == as_ts('2020-05-21T18:01:00.037201')
+
+
+def _update(meter_id, occupancy, time_of_ingest):
+    return {'event': 'update', 'payload': {'id': meter_id, 'limit': 'no-limit', 'occupancy': occupancy, 'time_of_ingest': time_of_ingest}}
+
+
+def test_availability_returns_valid_availability_for_zone_and_timestamp():
+    timestamp_to_test = as_ts('2020-05-21T17:15:01.000000')
+
+    zone_index, meter_index = fybr_availability_tracker.create_tracking_indices([
+        {'meter_id': '9860', 'zone_id': '0001'},
+        {'meter_id': '9861', 'zone_id': '0001'},
+        {'meter_id': '9862', 'zone_id': '0002'},
+        {'meter_id': '9863', 'zone_id': '0002'},
+        {'meter_id': '9864', 'zone_id': '0003'},
+        {'meter_id': '9865', 'zone_id': '0003'},
+        {'meter_id': '9866', 'zone_id': '0003'}
+    ])
+    zone_index['0004'] = zone_index.default_factory()
+
+    message_handler = fybr_availability_tracker.create_message_handler(meter_index)
+    zone_index = message_handler([
+        # 0001 is invalid because it has not seen a meter
+        _update('9861', 'UNOCCUPIED', '2020-05-21T18:01:00.037202'),
+
+        # 0002 is invalid because it has old meter data
+        _update('9862', 'OCCUPIED', '2020-05-21T17:00:00.000000'),
+        _update('9863', 'UNOCCUPIED', '2020-05-21T16:01:00.037202'),
+
+        # 0003 is valid because all data is within the last 5 minutes
+        _update('9864', 'OCCUPIED', '2020-05-21T17:09:00.032202'),
+        _update('9865', 'OCCUPIED', '2020-05-21T17:12:00.037202'),
+        _update('9866', 'UNOCCUPIED', '2020-05-21T17:11:00.037202'),
+        _update('9864', 'OCCUPIED', '2020-05-21T17:14:00.032202'),
+        _update('9865', 'UNOCCUPIED', '2020-05-21T17:12:00.037202')
+    ], zone_index)
 
     assert None == fybr_availability_tracker.availability(zone_index, '0001', timestamp_to_test)
     assert None == fybr_availability_tracker.availability(zone_index, '0002', timestamp_to_test)
     assert 0.6667 == fybr_availability_tracker.availability(zone_index, '0003', timestamp_to_test)
+    # 0004 is invalid because it has no meters
     assert None == fybr_availability_tracker.availability(zone_index, '0004', timestamp_to_test)
-    assert None == fybr_availability_tracker.availability(zone_index, 'missing zone', timestamp_to_test)
\ No newline at end of file
+    assert None == fybr_availability_tracker.availability(zone_index, 'missing zone', timestamp_to_test)
+
+
+def test_availability_tracks_the_oldest_meter_as_meters_report_in():
+    zone_index, meter_index = fybr_availability_tracker.create_tracking_indices([
+        {'meter_id': meter_id, 'zone_id': '0001'} for meter_id in ['9860', '9861', '9862']
+    ])
+    message_handler = fybr_availability_tracker.create_message_handler(meter_index)
+
+    for minute in range(30):
+        meter_id = ['9860', '9861', '9862'][minute % 3]
+        zone_index = message_handler(
+            [_update(meter_id, 'OCCUPIED', f'2020-05-21T17:{minute:0>2}:00.000000')],
+            zone_index
+        )
+
+    assert zone_index['0001']['oldest_last_seen'] == as_ts('2020-05-21T17:27:00.000000')
+    assert len(zone_index['0001']['last_seen_heap']) <= 2 * 3
+    assert 0.0 == fybr_availability_tracker.availability(zone_index, '0001', as_ts('2020-05-21T17:31:00.000000'))
+    assert None == fybr_availability_tracker.availability(zone_index, '0001', as_ts('2020-05-21T17:33:00.000000'))
+
+
+def test_handler_updates_the_index_in_place():
+    zone_index, meter_index = fybr_availability_tracker.create_tracking_indices([
+        {'meter_id': '9860', 'zone_id': '0001'}
+    ])
+    message_handler = fybr_availability_tracker.create_message_handler(meter_index)
+
+    messages = [
+        {'event': 'update', 'payload': {'id': '9860', 'limit': 'no-limit', 'occupancy': 'OCCUPIED', 'time_of_ingest': '2020-05-21T18:00:00.037201'}}
+    ]
+
+    assert message_handler(messages, zone_index) is zone_index
+    assert zone_index['0001']['meters']['9860']['occupied']
+
+
+@pytest.mark.benchmark
+def test_handler_processes_messages_faster_in_place_than_by_copying_the_index():
+    """
+    A poor man's benchmark, comparing the messages per second handled by
+    updating the index in place with those handled by reducing each message
+    into a deep copy of it, as the provider used to.
+    """
+    meter_and_zone_list = [
+        {'meter_id': f'{zone:0>4}{meter:0>2}', 'zone_id': f'{zone:0>4}'}
+        for zone in range(500)
+        for meter in range(20)
+    ]
+    messages = [
+        {'event': 'update', 'payload': {'id': meter['meter_id'], 'limit': 'no-limit', 'occupancy': 'OCCUPIED', 'time_of_ingest': '2020-05-21T18:00:00.037201'}}
+        for meter in meter_and_zone_list
+    ]
+
+    def _messages_per_second(handle, messages):
+        zone_index, meter_index = fybr_availability_tracker.create_tracking_indices(meter_and_zone_list)
+        message_handler = fybr_availability_tracker.create_message_handler(meter_index)
+
+        start_time = time.perf_counter()
+        for message in messages:
+            zone_index = handle(message_handler, [message], zone_index)
+        return len(messages) / (time.perf_counter() - start_time)
+
+    in_place = _messages_per_second(lambda handler, batch, zone_index: handler(batch, zone_index), messages)
+    # copying the whole index per message is slow enough that a sample will do
+    copying = _messages_per_second(lambda handler, batch, zone_index: handler(batch, deepcopy(zone_index)),
+                                   messages[:200])
+
+    LOGGER.info(f'Handled {in_place:.0f} messages per second in place, {copying:.0f} by copying the index')
+    assert in_place > 10_000
+    assert in_place > 10 * copying
@@ -5,7 +5,7 @@ import pytest
 import websockets
 from freezegun import freeze_time
 
-from app import app
+from app import app, keeper_of_the_state
 from app.fybr.availability_provider import FybrAvailabilityProvider
 from tests.fake_websocket_server import create_fake_server, update_event
 
@@ -96,6 +96,60 @@ async def test_zone_ids_restricts_zones_compared(client, all_valid_zone_ids):
     assert len(data) == 2
 
 
+async def test_range_returns_predictions_for_every_semihour(client, all_valid_zone_ids):
+    zone_ids = all_valid_zone_ids[:3]
+    response = await client.get(
+        '/api/v1/predictions/range'
+        '?start=2020-01-14T14:10:00&end=2020-01-14T15:00:00'
+        f'&zone_ids={",".join(zone_ids)}'
+    )
+    data = json.loads(await response.get_data())
+
+    assert response.status_code == 200
+    assert {(datum['time'], datum['zoneId']) for datum in data} == {
+        (time, zone_id)
+        for time in ['2020-01-14T14:00:00', '2020-01-14T14:30:00']
+        for zone_id in zone_ids
+    }
+
+
+async def test_range_buckets_times_with_an_offset_by_local_time(client, all_valid_zone_ids):
+    zone_ids = all_valid_zone_ids[:3]
+    response = await client.get(
+        '/api/v1/predictions/range'
+        '?start=2020-01-14T19:10:00Z&end=2020-01-14T20:00:00Z'
+        f'&zone_ids={",".join(zone_ids)}'
+    )
+    data = json.loads(await response.get_data())
+
+    assert response.status_code == 200
+    assert {(datum['time'], datum['zoneId']) for datum in data} == {
+        (time, zone_id)
+        for time in ['2020-01-14T14:00:00-05:00', '2020-01-14T14:30:00-05:00']
+        for zone_id in zone_ids
+    }
+
+
+async def test_range_outside_hours_of_operation_returns_no_predictions(client):
+    response = await client.get('/api/v1/predictions/range?start=2020-01-14T22:00:00&end=2020-01-15T07:00:00')
+    data = await response.get_data()
+
+    assert response.status_code == 200
+    assert json.loads(data) == []
+
+
+async def test_range_rejects_invalid_ranges(client):
+    missing_end = await client.get('/api/v1/predictions/range?start=2020-01-14T14:00:00')
+    backwards = await client.get('/api/v1/predictions/range?start=2020-01-14T14:00:00&end=2020-01-14T13:00:00')
+    too_long = await client.get('/api/v1/predictions/range?start=2020-01-01T14:00:00&end=2020-02-14T13:00:00')
+    mixed_offsets = await client.get('/api/v1/predictions/range?start=2020-01-14T14:00:00&end=2020-01-14T20:00:00Z')
+
+    assert missing_end.status_code == 400
+    assert backwards.status_code == 400
+    assert too_long.status_code == 400
+    assert mixed_offsets.status_code == 400
+
+
 @contextmanager
 def use_availability_provider(ap):
     og_ap = app.fybr_availability_provider
@@ -148,4 +202,30 @@ async def test_app_uses_availability_if_its_there(client, all_valid_zone_ids):
         'availabilityPrediction': 0.75,
         'zoneId': zone_with_availability_data,
         'supplierID': '970010'
-    }
\ No newline at end of file
+    }
+
+
+async def test_no_predictions_are_returned_before_models_are_loaded(monkeypatch):
+    for name in ['MODELS', 'MODEL_VERSIONS', 'PREDICTION_TABLES']:
+        monkeypatch.setattr(keeper_of_the_state, name, {})
+    client = app.test_client()
+
+    with freeze_time('2020-01-14 14:00:00'):
+        responses = [
+            await client.get('/api/v1/predictions'),
+            await client.get('/api/v1/predictions?zone_ids=red'),
+            await client.get('/api/v1/predictions/range?start=2020-01-14T14:00:00&end=2020-01-14T15:00:00')
+        ]
+
+    for response in responses:
+        assert response.status_code == 200
+        assert json.loads(await response.get_data()) == []
+
+
+async def test_readiness_reports_freshness_once_models_are_loaded(client):
+    response = await client.get('/readiness')
+    data = json.loads(await response.get_data())
+
+    assert response.status_code == 200
+    assert data['ready']
+    assert data['ageSeconds'] >= 0
@@ -1,4 +1,5 @@
 import builtins
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from os import path
 
@@ -39,3 +40,22 @@ def test_get_credentials_returns_empty_dictionary_with_no_token_file():
     )
 
     assert credentials == {}
+
+
+def test_s3_resources_are_reused_until_they_expire(aws_credentials):
+    auth_provider._thread_s3_resources().clear()
+
+    s3 = auth_provider.authorized_s3_resource()
+    assert auth_provider.authorized_s3_resource() is s3
+
+    auth_provider._thread_s3_resources().clear()
+    assert auth_provider.authorized_s3_resource() is not s3
+
+
+def test_s3_resources_are_not_shared_between_threads(aws_credentials):
+    s3 = auth_provider.authorized_s3_resource()
+
+    with ThreadPoolExecutor(1) as executor:
+        other_thread_s3 = executor.submit(auth_provider.authorized_s3_resource).result()
+
+    assert other_thread_s3 is not s3
@@ -0,0 +1,31 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+from app import enforcement_calendar
+from app.constants import TIME_ZONE
+from app.enforcement_calendar import NOT_ENFORCED, TOTAL_SEMIHOURS
+
+
+@pytest.mark.parametrize('timestamp, expected', [
+    (dt.datetime(2020, 9, 7, 8, 0), 0),
+    (dt.datetime(2020, 9, 8, 8, 29), TOTAL_SEMIHOURS),
+    (dt.datetime(2020, 9, 12, 21, 59), 5 * TOTAL_SEMIHOURS + 27),
+    (dt.datetime(2020, 9, 7, 7, 59), NOT_ENFORCED),
+    (dt.datetime(2020, 9, 7, 22, 0), NOT_ENFORCED),
+    (dt.datetime(2020, 9, 13, 12, 0), NOT_ENFORCED)
+])
+def test_slot_code_numbers_enforced_semihours_of_the_week(timestamp, expected):
+    assert enforcement_calendar.slot_code(timestamp) == expected
+    assert enforcement_calendar.is_enforced(timestamp) == (expected != NOT_ENFORCED)
+
+
+@pytest.mark.parametrize('tz', [None, TIME_ZONE])
+def test_slot_codes_match_slot_code_for_every_timestamp(tz):
+    timestamps = pd.date_range('2020-09-06 23:53', '2020-09-14 01:00', freq='7min', tz=tz)
+
+    slot_codes = enforcement_calendar.slot_codes(pd.Series(timestamps))
+
+    assert slot_codes.tolist() == [enforcement_calendar.slot_code(timestamp) for timestamp in timestamps]
+    assert set(slot_codes.tolist()) == set(range(enforcement_calendar.TOTAL_SLOTS)) | {NOT_ENFORCED}
@@ -1,16 +1,21 @@
+import json
+import os
 import pickle
 
 import boto3
-import joblib
 import pytest
+import responses
+from boto3.s3.transfer import TransferConfig
 from freezegun import freeze_time
 from mockito import kwargs
 from moto import mock_s3
 
-from app import keeper_of_the_state
-from app.constants import MODEL_FILE_NAME
+from app import keeper_of_the_state, model_artifact
+from app._models.deep_hong import ParkingAvailabilityModelv0EarlyAccessPreRelease
+from app.constants import DISCOVERY_API_QUERY_URL, MODEL_ARTIFACT_FILE_NAME, MODEL_FILE_NAME
 from app.keeper_of_the_state import MODELS_DIR_LATEST, MODELS_DIR_ROOT
 from app.model import ParkingAvailabilityModel
+from tests.conftest import ALL_VALID_ZONE_IDS
 
 
 @pytest.fixture(scope='function')
@@ -23,6 +28,12 @@ def model_bucket(aws_credentials):
         yield bucket
 
 
+def _load_archived_model(bucket, key, directory):
+    local_path = str(directory / key.replace('/', '_'))
+    bucket.download_file(key, local_path)
+    return model_artifact.load_model(local_path)
+
+
 @pytest.mark.asyncio
 async def test_warm_is_resilient(when, fake_model_files_in_s3):
     actual_boto3_session = boto3.Session()
@@ -32,7 +43,7 @@ async def test_warm_is_resilient(when, fake_model_files_in_s3):
     await keeper_of_the_state.warm_caches()
 
 
-def test_archive_model_writes_models_to_historical_and_latest_s3_paths(model_bucket, fake_model):
+def test_archive_model_writes_models_to_historical_and_latest_s3_paths(model_bucket, fake_model, tmp_path):
     year, month, day = 2020, 1, 14
     with freeze_time(f'{year}-{month:0>2}-{day:0>2} 14:00:00'):
         keeper_of_the_state.archive_model(fake_model)
@@ -43,30 +54,22 @@ def test_archive_model_writes_models_to_historical_and_latest_s3_paths(model_buc
     ]
 
     for expected_key_prefix in expected_archive_key_prefixes:
-        expected_model_key = f'{expected_key_prefix}/{MODEL_FILE_NAME}'
-        unpickled_model = pickle.loads(model_bucket.Object(expected_model_key).get()['Body'].read())
-        assert (
-            joblib.hash(unpickled_model) == joblib.hash(fake_model)
-            or unpickled_model == fake_model
-        ), (
-            f'Model archive at {expected_model_key} did not unpickle into '
+        expected_model_key = f'{expected_key_prefix}/{MODEL_ARTIFACT_FILE_NAME}'
+        archived_model = _load_archived_model(model_bucket, expected_model_key, tmp_path)
+        assert archived_model == fake_model, (
+            f'Model archive at {expected_model_key} did not load into '
             f'its original form.'
         )
 
 
-def test_archive_model_overwrites_the_latest_model_archive(model_bucket, fake_dataset, fake_model):
-    key_for_latest_model_archive = f'{MODELS_DIR_LATEST}/{MODEL_FILE_NAME}'
+def test_archive_model_overwrites_the_latest_model_archive(model_bucket, fake_dataset, fake_model, tmp_path):
+    key_for_latest_model_archive = f'{MODELS_DIR_LATEST}/{MODEL_ARTIFACT_FILE_NAME}'
 
     with freeze_time('2020-01-14 14:00:00'):
         keeper_of_the_state.archive_model(fake_model)
 
-    latest_model_in_archive = pickle.loads(
-        model_bucket.Object(key_for_latest_model_archive).get()['Body'].read()
-    )
-    assert (
-        joblib.hash(latest_model_in_archive) == joblib.hash(fake_model)
-        or latest_model_in_archive == fake_model
-    )
+    latest_model_in_archive = _load_archived_model(model_bucket, key_for_latest_model_archive, tmp_path / 'first')
+    assert latest_model_in_archive == fake_model
 
     new_model = ParkingAvailabilityModel()
     new_model.train(fake_dataset.sample(frac=0.5).reset_index(drop=True))
@@ -74,11 +77,221 @@ def test_archive_model_overwrites_the_latest_model_archive(model_bucket, fake_da
     with freeze_time('2020-01-15 14:00:00'):
         keeper_of_the_state.archive_model(new_model)
 
-    latest_model_in_archive = pickle.loads(
-        model_bucket.Object(key_for_latest_model_archive).get()['Body'].read()
-    )
-    assert (
-        joblib.hash(latest_model_in_archive) == joblib.hash(new_model)
-        or latest_model_in_archive == new_model
-    )
-    assert len(list(model_bucket.objects.filter(Prefix=MODELS_DIR_LATEST))) == 1
\ No newline at end of file
+    latest_model_in_archive = _load_archived_model(model_bucket, key_for_latest_model_archive, tmp_path / 'second')
+    assert latest_model_in_archive == new_model
+    assert len(list(model_bucket.objects.filter(Prefix=MODELS_DIR_LATEST))) == 2
+
+
+def test_archive_model_keeps_writing_pickles_for_older_pods(model_bucket, fake_model, tmp_path):
+    keeper_of_the_state.archive_model(fake_model)
+
+    pickle_path = str(tmp_path / MODEL_FILE_NAME)
+    model_bucket.download_file(f'{MODELS_DIR_LATEST}/{MODEL_FILE_NAME}', pickle_path)
+    with open(pickle_path, 'rb') as pickle_file:
+        assert pickle.load(pickle_file) == fake_model
+
+
+@pytest.mark.asyncio
+async def test_archived_models_are_fetched_from_artifacts(model_bucket, fake_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    keeper_of_the_state.archive_model(fake_model)
+
+    model_tag, fetched_model, _model_etag = await keeper_of_the_state._fetch_all('latest')
+
+    assert model_tag == 'latest'
+    assert fetched_model == fake_model
+
+
+@pytest.mark.asyncio
+async def test_pickled_models_are_still_fetched(model_bucket, fake_model):
+    model_bucket.put_object(Body=pickle.dumps(fake_model), Key=f'{MODELS_DIR_ROOT}/legacy/{MODEL_FILE_NAME}')
+
+    _model_tag, fetched_model, _model_etag = await keeper_of_the_state._fetch_all('legacy')
+
+    assert fetched_model == fake_model
+
+
+@pytest.mark.asyncio
+async def test_missing_model_files_keep_the_model_being_served(model_bucket):
+    known_model_etag = ('artifact', 'models/missing/model.artifact', '"etag"')
+
+    _model_tag, fetched_model, model_etag = await keeper_of_the_state._fetch_all('missing', known_model_etag)
+
+    assert fetched_model is None
+    assert model_etag == known_model_etag
+
+
+@pytest.mark.asyncio
+async def test_models_are_not_fetched_again_while_their_etag_is_unchanged(model_bucket, fake_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    keeper_of_the_state.archive_model(fake_model)
+
+    _model_tag, _fetched_model, model_etag = await keeper_of_the_state._fetch_all('latest')
+    _model_tag, unchanged_model, unchanged_model_etag = await keeper_of_the_state._fetch_all('latest', model_etag)
+
+    assert unchanged_model is None
+    assert unchanged_model_etag == model_etag
+
+    keeper_of_the_state.archive_model(fake_model.__class__(weeks_to_average=2))
+    _model_tag, changed_model, changed_model_etag = await keeper_of_the_state._fetch_all('latest', model_etag)
+
+    assert changed_model is not None
+    assert changed_model_etag != model_etag
+
+
+@pytest.mark.asyncio
+async def test_warm_caches_skips_unchanged_models(with_warmup, monkeypatch):
+    fetched_model_paths = []
+    fetch_model = keeper_of_the_state._fetch_model
+
+    def _recording_fetch_model(model_format, bucket, model_path, model_etag):
+        fetched_model_paths.append(model_path)
+        return fetch_model(model_format, bucket, model_path, model_etag)
+
+    monkeypatch.setattr(keeper_of_the_state, '_fetch_model', _recording_fetch_model)
+    model_version = keeper_of_the_state.provide_model_version('latest')
+
+    assert await keeper_of_the_state.warm_caches() is False
+    assert fetched_model_paths == []
+    assert keeper_of_the_state.provide_model_version('latest') == model_version
+
+
+def test_changing_only_the_zones_changes_the_model_versions(monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODELS', {'latest': 'model'})
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_VERSIONS', {'latest': 1})
+    monkeypatch.setattr(keeper_of_the_state, 'PREDICTION_TABLES', {})
+    monkeypatch.setattr(keeper_of_the_state, 'ZONE_REGISTRY', keeper_of_the_state.ZoneRegistry(['a']))
+    monkeypatch.setattr(keeper_of_the_state, 'STATE_CHECKED_AT', None)
+
+    keeper_of_the_state.install_state({}, {}, ['a'])
+    assert keeper_of_the_state.provide_model_version('latest') == 1
+
+    keeper_of_the_state.install_state({}, {}, ['a', 'b'])
+    assert keeper_of_the_state.provide_model_version('latest') == 2
+    assert keeper_of_the_state.provide_model('latest') == 'model'
+
+
+def test_models_taking_other_features_are_served_without_a_prediction_table(fake_dataset):
+    model = ParkingAvailabilityModelv0EarlyAccessPreRelease()
+    model.train(fake_dataset[fake_dataset.zone_id.isin(ALL_VALID_ZONE_IDS[:3])])
+
+    assert keeper_of_the_state._build_prediction_table(model) is None
+
+
+def test_zone_registry_filters_unknown_zones_preserving_order():
+    zone_registry = keeper_of_the_state.ZoneRegistry(['b', 'a', 'c', 'a'])
+
+    assert zone_registry.all == ('b', 'a', 'c')
+    assert zone_registry.ordinals == {'b': 0, 'a': 1, 'c': 2}
+    assert zone_registry.known(['c', 'x', 'b', 'c']) == ['c', 'b']
+
+
+def test_zone_discovery_errors_keep_the_known_zones(monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'ZONE_REGISTRY', keeper_of_the_state.ZoneRegistry(['red', 'school']))
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.POST, DISCOVERY_API_QUERY_URL, '<html>Bad Gateway</html>', status=502)
+
+        assert keeper_of_the_state._fetch_zone_ids() == ['red', 'school']
+
+
+@pytest.mark.asyncio
+async def test_warm_caches_replaces_the_zone_registry(with_warmup, all_valid_zone_ids):
+    zone_registry = keeper_of_the_state.provide_zone_registry()
+
+    assert set(zone_registry.all) == set(all_valid_zone_ids)
+    assert keeper_of_the_state.provide_zones() == zone_registry.all
+
+
+@pytest.mark.asyncio
+async def test_models_larger_than_a_part_are_fetched_in_parts(model_bucket, fake_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(keeper_of_the_state, 'DOWNLOAD_CONFIG', TransferConfig(
+        multipart_threshold=5 * 1024,
+        multipart_chunksize=5 * 1024,
+        max_concurrency=4
+    ))
+    pickled_model = pickle.dumps(fake_model)
+    assert len(pickled_model) > 2 * 5 * 1024
+    model_bucket.put_object(Body=pickled_model, Key=f'{MODELS_DIR_ROOT}/large/{MODEL_FILE_NAME}')
+
+    _model_tag, fetched_model, _model_etag = await keeper_of_the_state._fetch_all('large')
+
+    assert fetched_model == fake_model
+
+
+@pytest.mark.asyncio
+async def test_cached_models_are_not_downloaded_again(model_bucket, fake_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    keeper_of_the_state.archive_model(fake_model)
+    await keeper_of_the_state._fetch_all('latest')
+
+    bucket_for_environment = keeper_of_the_state._bucket_for_environment
+
+    def _bucket_without_downloads():
+        bucket = bucket_for_environment()
+        bucket.download_file = lambda *args, **kwargs: pytest.fail('cached models should not be downloaded')
+        return bucket
+
+    monkeypatch.setattr(keeper_of_the_state, '_bucket_for_environment', _bucket_without_downloads)
+    _model_tag, fetched_model, _model_etag = await keeper_of_the_state._fetch_all('latest')
+
+    assert fetched_model == fake_model
+
+
+def test_least_recently_used_models_are_evicted_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_MAX_BYTES', 2048)
+    for age, name in enumerate(['newest', 'newer', 'older', 'oldest']):
+        cached_model = tmp_path / f'{name}.artifact'
+        cached_model.write_bytes(bytes(1024))
+        os.utime(cached_model, (1_000_000 - age, 1_000_000 - age))
+
+    keeper_of_the_state._evict_cached_models(keep=str(tmp_path / 'oldest.artifact'))
+
+    assert sorted(os.listdir(tmp_path)) == ['newest.artifact', 'oldest.artifact']
+
+
+@pytest.mark.asyncio
+async def test_warmed_state_is_restored_from_a_snapshot(model_bucket, mocked_scos_zone_ids_query, fake_model,
+                                                        all_valid_zone_ids, tmp_path, monkeypatch):
+    monkeypatch.setenv('COMPARED_MODELS', '')
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    keeper_of_the_state.archive_model(fake_model)
+    await keeper_of_the_state.warm_caches()
+    checked_at = keeper_of_the_state.provide_state_checked_at()
+
+    for state in ['MODELS', 'MODEL_VERSIONS', 'PREDICTION_TABLES', 'MODEL_ETAGS']:
+        monkeypatch.setattr(keeper_of_the_state, state, {})
+    monkeypatch.setattr(keeper_of_the_state, 'ZONE_REGISTRY', keeper_of_the_state.ZoneRegistry())
+
+    assert await keeper_of_the_state.restore_snapshot()
+    assert keeper_of_the_state.provide_model('latest') == fake_model
+    assert keeper_of_the_state.provide_prediction_table('latest') is not None
+    assert set(keeper_of_the_state.provide_zones()) == set(all_valid_zone_ids)
+    assert keeper_of_the_state.provide_state_checked_at() == checked_at
+    assert 'latest' in keeper_of_the_state.MODEL_ETAGS
+
+
+@pytest.mark.asyncio
+async def test_nothing_is_restored_without_a_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+
+    assert not await keeper_of_the_state.restore_snapshot()
+
+
+@pytest.mark.asyncio
+async def test_corrupt_snapshots_are_deleted_instead_of_restored(tmp_path, monkeypatch):
+    monkeypatch.setattr(keeper_of_the_state, 'MODEL_CACHE_DIR', str(tmp_path))
+    cached_model_path = keeper_of_the_state._cached_model_path('artifact', '"etag"')
+    with open(cached_model_path, 'wb') as cached_model:
+        cached_model.write(b'not a model')
+    (tmp_path / keeper_of_the_state.SNAPSHOT_FILE_NAME).write_text(json.dumps({
+        'model_etags': {'latest': ['artifact', 'models/latest/model.artifact', '"etag"']},
+        'zone_ids': [],
+        'checked_at': '2020-01-14T14:00:00'
+    }))
+
+    assert not await keeper_of_the_state.restore_snapshot()
+    assert not os.path.exists(cached_model_path)
+    assert not (tmp_path / keeper_of_the_state.SNAPSHOT_FILE_NAME).exists()
@@ -5,12 +5,19 @@ from typing import Iterable
 
 import hypothesis.strategies as st
 import joblib
+import numpy as np
+import pandas as pd
 import pendulum
+import pytest
 from hypothesis import given
 
+from app import model_artifact
+from app._models.deep_hong import (ModelFeaturesv0EarlyAccessPreRelease,
+                                   ParkingAvailabilityModelv0EarlyAccessPreRelease)
+from app._models.training_executor import TrainingExecutor
 from app.constants import DAY_OF_WEEK, HOURS_START, TIME_ZONE, UNENFORCED_DAYS
 from app.data_formats import APIPredictionRequest
-from app.model import ModelFeatures
+from app.model import ModelFeatures, ParkingAvailabilityModel
 from app.predictor import to_api_format
 from tests.conftest import ALL_VALID_ZONE_IDS
 
@@ -56,6 +63,122 @@ def test_ParkingAvailabilityModel_returns_one_prediction_per_valid_zone_id(times
     assert set(predictions.keys()) == set(zone_ids)
 
 
+def _most_recent_rolling_average(dataset, zone_id, timestamp, weeks_to_average):
+    semihour_in_zone = dataset.loc[
+        (dataset.zone_id == zone_id)
+        & (dataset.semihour.dt.dayofweek == timestamp.weekday())
+        & (dataset.semihour.dt.hour == timestamp.hour)
+        & (dataset.semihour.dt.minute == 30 * (timestamp.minute // 30))
+    ].sort_values('semihour')
+    rolling_averages = (
+        (1 - semihour_in_zone.occu_cnt_rate)
+            .shift()
+            .rolling(weeks_to_average, 1)
+            .mean()
+            .dropna()
+            .clip(0, 1)
+    )
+    return None if rolling_averages.empty else rolling_averages.iloc[-1]
+
+
+@given(
+    timestamp=DATETIME_DURING_HOURS_OF_OPERATION,
+    zone_id=st.sampled_from(ALL_VALID_ZONE_IDS)
+)
+def test_ParkingAvailabilityModel_predicts_the_most_recent_rolling_average(timestamp, zone_id, fake_model, fake_dataset):
+    predictions = fake_model.predict([ModelFeatures(zone_id=zone_id, at=timestamp)])
+
+    expected = _most_recent_rolling_average(fake_dataset, zone_id, timestamp,
+                                            fake_model.weeks_to_average)
+    assert predictions.get(zone_id) == pytest.approx(expected)
+
+
+def test_ParkingAvailabilityModel_averages_over_several_weeks(fake_dataset):
+    model = ParkingAvailabilityModel(weeks_to_average=3)
+    model.train(fake_dataset)
+
+    for zone_id in ALL_VALID_ZONE_IDS[:5]:
+        for timestamp in [dt.datetime(2020, 9, 21, 8, 0), dt.datetime(2020, 9, 26, 21, 30)]:
+            predictions = model.predict([ModelFeatures(zone_id=zone_id, at=timestamp)])
+            expected = _most_recent_rolling_average(fake_dataset, zone_id, timestamp, 3)
+            assert predictions.get(zone_id) == pytest.approx(expected)
+
+
+def test_ParkingAvailabilityModel_trains_the_same_on_chunks(fake_dataset):
+    model = ParkingAvailabilityModel(weeks_to_average=2)
+    model.train(fake_dataset)
+
+    shuffled_dataset = fake_dataset.sample(frac=1, random_state=42).astype({'zone_id': 'category'})
+    chunked_model = ParkingAvailabilityModel(weeks_to_average=2)
+    chunked_model.train_incrementally(np.array_split(shuffled_dataset, 7))
+
+    assert chunked_model == model
+
+
+def test_ParkingAvailabilityModel_updates_the_same_as_it_trains(fake_dataset, tmp_path):
+    model = ParkingAvailabilityModel(weeks_to_average=2)
+    model.train(fake_dataset)
+
+    cutoff = pd.Timestamp('2020-09-14')
+    early_model = ParkingAvailabilityModel(weeks_to_average=2)
+    early_model.train(fake_dataset.loc[fake_dataset.semihour < cutoff])
+
+    artifact_path = tmp_path / 'model.artifact'
+    with open(artifact_path, 'wb') as artifact_file:
+        model_artifact.dump_model(early_model, artifact_file)
+    updated_model = model_artifact.load_model(str(artifact_path))
+    assert updated_model.watermark < cutoff
+
+    # new data overlaps the day before the cutoff, which must not be counted twice
+    updated_model.update([fake_dataset.loc[fake_dataset.semihour >= cutoff - pd.Timedelta(days=2)]])
+
+    assert updated_model == model
+    assert updated_model.watermark == fake_dataset.semihour.max()
+    assert pickle.loads(pickle.dumps(updated_model)).watermark == updated_model.watermark
+
+
+def test_ParkingAvailabilityModel_forgets_observations_older_than_six_months(fake_dataset):
+    model = ParkingAvailabilityModel(weeks_to_average=2)
+    model.train(fake_dataset)
+
+    zone_id = ALL_VALID_ZONE_IDS[0]
+    seven_months_later = (
+        fake_dataset.loc[fake_dataset.zone_id == zone_id]
+            .assign(semihour=lambda df: df.semihour + pd.Timedelta(weeks=30))
+    )
+    model.update([seven_months_later])
+
+    assert list(model.supported_zones) == [zone_id]
+    assert model._recent_zone_ids == [zone_id]
+    assert model.watermark == seven_months_later.semihour.max()
+
+
+@pytest.mark.benchmark
+def test_ParkingAvailabilityModel_trains_on_six_months_in_seconds():
+    semihours = pd.date_range('2020-03-02 08:00', '2020-08-29 22:00', freq='30min')
+    semihours = semihours[(semihours.dayofweek < 6) & (semihours.hour >= 8) & (semihours.hour < 22)]
+    zone_ids = [f'zone {zone}' for zone in range(100)]
+    training_data = pd.DataFrame({
+        'zone_id': np.repeat(zone_ids, len(semihours)),
+        'semihour': np.tile(semihours, len(zone_ids)),
+        'occu_cnt_rate': np.random.default_rng(seed=42).uniform(size=len(zone_ids) * len(semihours))
+    })
+
+    start_time = time.time()
+    ParkingAvailabilityModel(weeks_to_average=4).train(training_data)
+    assert time.time() - start_time < 10
+
+
+def test_ParkingAvailabilityModel_supported_zone_set_follows_retraining(fake_dataset):
+    model = ParkingAvailabilityModel()
+    model.train(fake_dataset)
+    assert model.supported_zone_set == frozenset(fake_dataset.zone_id)
+    assert model.supported_zone_set is model.supported_zone_set
+
+    model.train(fake_dataset[fake_dataset.zone_id == 'auto'])
+    assert model.supported_zone_set == {'auto'}
+
+
 def test_ParkingAvailabilityModel_is_picklable(fake_model):
     pickle.dumps(fake_model)
 
@@ -96,3 +219,45 @@ def test_ParkingAvailabilityModel_predict_runs_in_under_a_second(fake_model):
     ))
     end_time = time.time()
     assert end_time - start_time < 1
+
+
+def test_MLP_model_batched_predictions_match_per_zone_predictions(fake_dataset):
+    zone_ids = ALL_VALID_ZONE_IDS[:3]
+    model = ParkingAvailabilityModelv0EarlyAccessPreRelease()
+    model.train(fake_dataset[fake_dataset.zone_id.isin(zone_ids)])
+
+    samples_batch = ModelFeaturesv0EarlyAccessPreRelease.from_request(
+        APIPredictionRequest.construct(
+            timestamp=dt.datetime(2020, 9, 8, 14, 0),
+            zone_ids=zone_ids
+        )
+    )
+    regressor_features = np.asarray([samples_batch[0].semihour_onehot
+                                     + samples_batch[0].dayofweek_onehot])
+
+    expected = {
+        zone_id: model._zone_models[zone_id].predict(regressor_features).clip(0, 1)[0]
+        for zone_id in zone_ids
+    }
+    assert model.predict(samples_batch) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_TrainingExecutor_fits_one_model_per_key_and_times_them(workers):
+    executor = TrainingExecutor(workers=workers)
+    training_data = {zone_id: np.arange(len(zone_id)) for zone_id in ALL_VALID_ZONE_IDS}
+
+    models = executor.fit_all(np.sum, training_data)
+
+    assert models == {zone_id: np.arange(len(zone_id)).sum() for zone_id in ALL_VALID_ZONE_IDS}
+    assert executor.timings.keys() == training_data.keys()
+
+
+def test_MLP_model_trains_zones_in_worker_processes(fake_dataset):
+    zone_ids = ALL_VALID_ZONE_IDS[:3]
+    model = ParkingAvailabilityModelv0EarlyAccessPreRelease()
+    model.training_executor = TrainingExecutor(workers=2)
+    model.train(fake_dataset[fake_dataset.zone_id.isin(zone_ids)])
+
+    assert list(model.supported_zones) == zone_ids
+    assert set(model.training_executor.timings) == set(zone_ids)
@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+import pytest
+
+from app import model_artifact
+
+
+def test_arrays_roundtrip_through_an_artifact(tmp_path):
+    arrays = {
+        'table': np.arange(24, dtype=np.float64).reshape(2, 3, 4),
+        'rows': np.array([3, 1, 2], dtype=np.int32)
+    }
+    artifact_path = tmp_path / 'test.artifact'
+    with open(artifact_path, 'wb') as artifact_file:
+        model_artifact.write(artifact_file, {'answer': 42}, arrays)
+
+    header, loaded_arrays = model_artifact.read(str(artifact_path))
+
+    assert header == {'answer': 42}
+    assert loaded_arrays.keys() == arrays.keys()
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(loaded_arrays[name], array)
+        assert loaded_arrays[name].dtype == array.dtype
+        assert not loaded_arrays[name].flags.writeable
+
+
+def test_models_roundtrip_through_an_artifact(fake_model, tmp_path):
+    artifact_path = tmp_path / 'model.artifact'
+    with open(artifact_path, 'wb') as artifact_file:
+        model_artifact.dump_model(fake_model, artifact_file)
+
+    assert model_artifact.load_model(str(artifact_path)) == fake_model
+
+
+def test_object_arrays_can_not_be_written():
+    with pytest.raises(TypeError):
+        model_artifact.write(io.BytesIO(), {}, {'objects': np.array([{}, []], dtype=object)})
+
+
+def test_other_files_are_rejected(tmp_path):
+    not_an_artifact_path = tmp_path / 'model.pkl'
+    not_an_artifact_path.write_bytes(b'\x80\x04not an artifact')
+
+    with pytest.raises(ValueError):
+        model_artifact.read(str(not_an_artifact_path))
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import occupancy_cache
+
+pytest.importorskip('pyarrow')
+
+NOW = pd.Timestamp.utcnow().tz_localize(None)
+SINCE = (NOW - pd.DateOffset(months=2)).normalize()
+ZONE_IDS = ['1001', '31/A']
+
+
+@pytest.fixture(scope='module')
+def occupancy():
+    semihours = pd.date_range(SINCE.to_period('M').start_time, NOW, freq='30min')
+    rng = np.random.default_rng(seed=42)
+    return pd.DataFrame({
+        'zone_name': np.repeat(ZONE_IDS, len(semihours)),
+        'semihour': np.tile(semihours, len(ZONE_IDS)),
+        'occu_cnt_rate': rng.uniform(size=len(ZONE_IDS) * len(semihours)),
+        'occu_min': rng.integers(0, 30, size=len(ZONE_IDS) * len(semihours))
+    })
+
+
+@pytest.fixture
+def database(occupancy):
+    class _FakeDatabase:
+        def __init__(self):
+            self.reads = []
+
+        def read_occupancy(self, since):
+            self.reads.append(since)
+            return np.array_split(occupancy.loc[occupancy.semihour >= since], 3)
+
+    return _FakeDatabase()
+
+
+def _sorted(occupancy):
+    return occupancy.sort_values(['zone_name', 'semihour'], ignore_index=True)
+
+
+def test_cached_occupancy_is_read_back(tmp_path, occupancy, database):
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, SINCE)
+
+    cached_occupancy = occupancy_cache.read(str(tmp_path))
+
+    pd.testing.assert_frame_equal(_sorted(cached_occupancy), _sorted(occupancy))
+    assert database.reads == [SINCE.to_period('M').start_time]
+
+
+def test_refreshing_only_reads_months_that_may_have_changed(tmp_path, occupancy, database):
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, SINCE)
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, SINCE)
+
+    assert database.reads[-1] == (NOW - occupancy_cache.REFRESH_OVERLAP).to_period('M').start_time
+    pd.testing.assert_frame_equal(_sorted(occupancy_cache.read(str(tmp_path))), _sorted(occupancy))
+
+
+def test_refreshing_removes_months_before_since(tmp_path, occupancy, database):
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, SINCE)
+    later_since = (SINCE + pd.DateOffset(months=1)).to_period('M').start_time
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, later_since)
+
+    assert f'month={SINCE.to_period("M")}' not in {path.name for path in tmp_path.iterdir()}
+    pd.testing.assert_frame_equal(_sorted(occupancy_cache.read(str(tmp_path))),
+                                  _sorted(occupancy.loc[occupancy.semihour >= later_since]))
+
+
+def test_cached_occupancy_can_be_filtered(tmp_path, occupancy, database):
+    occupancy_cache.refresh(str(tmp_path), database.read_occupancy, SINCE)
+
+    since = NOW - pd.Timedelta(days=3)
+    chunks = list(occupancy_cache.read_chunks(str(tmp_path), ['zone_name', 'occu_cnt_rate'], since, ['31/A']))
+
+    expected = occupancy.loc[(occupancy.semihour >= since) & (occupancy.zone_name == '31/A'),
+                             ['zone_name', 'occu_cnt_rate']]
+    assert all(list(chunk.columns) == ['zone_name', 'occu_cnt_rate'] for chunk in chunks)
+    assert sorted(pd.concat(chunks).occu_cnt_rate) == sorted(expected.occu_cnt_rate)
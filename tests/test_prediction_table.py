@@ -0,0 +1,58 @@
+import datetime as dt
+
+import hypothesis.strategies as st
+import pendulum
+import pytest
+from hypothesis import given
+
+from app import keeper_of_the_state
+from app.constants import DAY_OF_WEEK, HOURS_START, TIME_ZONE, UNENFORCED_DAYS
+from app.model import ModelFeatures
+from app.prediction_table import PredictionTable, slot_of
+from tests.conftest import ALL_VALID_ZONE_IDS
+
+DATETIME_DURING_HOURS_OF_OPERATION = st.builds(
+    dt.datetime.combine,
+    date=st.dates(
+        min_value=dt.date(2020, 9, 7),
+        max_value=dt.date(2020, 9, 19)
+    ).filter(
+        lambda dt: DAY_OF_WEEK(dt.weekday()) not in UNENFORCED_DAYS
+    ),
+    time=st.times(HOURS_START, pendulum.time(21, 59, 59, 999999)),
+    tzinfo=st.sampled_from([TIME_ZONE, None])
+)
+
+
+@pytest.fixture(scope='module')
+def prediction_table(fake_model):
+    return PredictionTable.build(fake_model)
+
+
+@given(
+    timestamp=DATETIME_DURING_HOURS_OF_OPERATION,
+    zone_ids=st.lists(st.sampled_from(ALL_VALID_ZONE_IDS), min_size=1, max_size=20)
+)
+def test_lookup_matches_model_predictions(timestamp, zone_ids, fake_model, prediction_table):
+    expected = fake_model.predict([ModelFeatures(zone_id=zone_id, at=timestamp)
+                                   for zone_id in zone_ids])
+    assert prediction_table.lookup(timestamp, zone_ids) == expected
+
+
+def test_lookup_outside_hours_of_operation_is_empty(prediction_table):
+    assert prediction_table.lookup(dt.datetime(2020, 9, 8, 22, 0), ALL_VALID_ZONE_IDS) == {}
+    assert prediction_table.lookup(dt.datetime(2020, 9, 13, 12, 0), ALL_VALID_ZONE_IDS) == {}
+
+
+def test_slot_of_covers_the_enforcement_grid():
+    assert slot_of(dt.datetime(2020, 9, 7, 8, 0)) == (0, 0)
+    assert slot_of(dt.datetime(2020, 9, 12, 21, 59)) == (5, 27)
+    assert slot_of(dt.datetime(2020, 9, 7, 7, 59)) is None
+    assert slot_of(dt.datetime(2020, 9, 13, 8, 0)) is None
+
+
+def test_warm_caches_builds_prediction_tables(with_warmup):
+    prediction_table = keeper_of_the_state.provide_prediction_table('latest')
+
+    assert prediction_table is not None
+    assert set(prediction_table.zone_ids) == set(keeper_of_the_state.provide_model('latest').supported_zones)
@@ -1,6 +1,20 @@
+import logging
+import timeit
 from datetime import datetime
 
+import pytest
+from pydantic import BaseModel, constr
+
 from app import predictor
+from app.data_formats import APIPrediction, APIPredictionRequest
+from app.model import ModelFeatures
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ValidatedFeatures(BaseModel):
+    zone_id: constr(min_length=1)
+    at: datetime
 
 
 def test_predict_results_are_ordered(with_warmup, all_valid_zone_ids):
@@ -40,3 +54,58 @@ def test_predict_for_provided_zone_ids(with_warmup, all_valid_zone_ids):
     assert predictions
     for prediction in predictions:
         assert prediction['zoneId'] in zone_ids
+
+
+def test_predict_with_compares_models_per_requested_zone(with_warmup, all_valid_zone_ids):
+    zone_ids = all_valid_zone_ids[:3] + ['not a zone']
+    timestamp = datetime(2020, 2, 8, 14)
+
+    comparison = predictor.predict_with(['latest', '12month', 'missing'], timestamp, zone_ids)
+
+    latest_predictions = predictor.predict(timestamp, zone_ids, 'latest')
+    assert comparison == [
+        {
+            'zoneId': zone_id,
+            'latestPrediction': latest_predictions.get(zone_id),
+            '12monthPrediction': latest_predictions.get(zone_id),
+            'missingPrediction': None
+        }
+        for zone_id in all_valid_zone_ids[:3]
+    ]
+
+
+def test_predict_with_returns_no_comparison_after_hours(with_warmup):
+    assert predictor.predict_with(['latest', '12month'], datetime(2020, 2, 8, 23)) == []
+
+
+def test_api_format_matches_validated_predictions():
+    predictions = {'splash': 0.123456, 'red': 0.0, 'school': 1.0}
+
+    assert predictor.to_api_format(predictions) == [
+        APIPrediction(zoneId=zone_id, availabilityPrediction=availability).dict()
+        for zone_id, availability in predictions.items()
+    ]
+
+
+@pytest.mark.benchmark
+def test_unvalidated_records_are_cheaper_per_zone_than_validated_ones(all_valid_zone_ids):
+    zone_ids = [f'{zone_id}{copy}' for copy in range(50) for zone_id in all_valid_zone_ids]
+    timestamp = datetime(2020, 2, 8, 14)
+    request = APIPredictionRequest.construct(timestamp=timestamp, zone_ids=zone_ids)
+    predictions = dict.fromkeys(zone_ids, 0.5)
+
+    def _per_zone_microseconds(construct_records):
+        return 1e6 * min(timeit.repeat(construct_records, number=1, repeat=5)) / len(zone_ids)
+
+    validated_cost = _per_zone_microseconds(lambda: (
+        [ValidatedFeatures(zone_id=zone_id, at=timestamp) for zone_id in zone_ids],
+        [APIPrediction(zoneId=zone_id, availabilityPrediction=availability).dict()
+         for zone_id, availability in predictions.items()]
+    ))
+    unvalidated_cost = _per_zone_microseconds(lambda: (
+        ModelFeatures.from_request(request),
+        predictor.to_api_format(predictions)
+    ))
+
+    LOGGER.info(f'Per-zone cost: {validated_cost:.2f}us validated, {unvalidated_cost:.2f}us unvalidated')
+    assert unvalidated_cost < validated_cost
@@ -0,0 +1,38 @@
+import json
+from datetime import datetime
+
+from app import keeper_of_the_state, predictor, response_cache
+
+
+def test_cached_predictions_match_uncached_predictions(with_warmup):
+    timestamp = datetime(2020, 2, 8, 13, 29, 0)
+
+    body = response_cache.all_zone_predictions(timestamp, {})
+
+    assert json.loads(body) == predictor.predict_formatted(timestamp)
+
+
+def test_known_availabilities_override_cached_predictions(with_warmup, all_valid_zone_ids):
+    timestamp = datetime(2020, 2, 8, 13, 29, 0)
+    overridden_zone_id = all_valid_zone_ids[3]
+
+    body = response_cache.all_zone_predictions(
+        timestamp, {overridden_zone_id: 0.12345, 'not a zone': 0.5}
+    )
+
+    expected = predictor.predict(timestamp)
+    expected[overridden_zone_id] = 0.12345
+    assert json.loads(body) == predictor.to_api_format(expected)
+    assert json.loads(response_cache.all_zone_predictions(timestamp, {})) == predictor.predict_formatted(timestamp)
+
+
+def test_cache_is_keyed_by_semihour_and_model_version(with_warmup, monkeypatch):
+    first = response_cache.all_zone_predictions(datetime(2020, 2, 8, 13, 0, 0), {})
+    same_semihour = response_cache.all_zone_predictions(datetime(2020, 2, 8, 13, 29, 59), {})
+    assert first is same_semihour
+
+    monkeypatch.setitem(keeper_of_the_state.MODEL_VERSIONS, 'latest',
+                        keeper_of_the_state.MODEL_VERSIONS.get('latest', 0) + 1)
+    after_model_refresh = response_cache.all_zone_predictions(datetime(2020, 2, 8, 13, 0, 0), {})
+    assert first is not after_model_refresh
+    assert first == after_model_refresh
@@ -0,0 +1,146 @@
+import asyncio
+import os
+
+import pytest
+
+from app import keeper_of_the_state, shared_state
+from app.prediction_table import PredictionTable
+
+
+@pytest.fixture(autouse=True)
+def served_state(monkeypatch):
+    """Restore the state being served after tests that install published state."""
+    for name in ['MODELS', 'MODEL_VERSIONS', 'MODEL_ETAGS', 'PREDICTION_TABLES']:
+        monkeypatch.setattr(keeper_of_the_state, name, {})
+    monkeypatch.setattr(keeper_of_the_state, 'ZONE_REGISTRY', keeper_of_the_state.ZoneRegistry())
+    monkeypatch.setattr(keeper_of_the_state, 'STATE_CHECKED_AT', None)
+
+
+@pytest.fixture(scope='module')
+def prediction_table(fake_model):
+    return PredictionTable.build(fake_model)
+
+
+def _publish(directory, model, prediction_table, zone_ids):
+    shared_state.publish_state(
+        str(directory),
+        models={'latest': model},
+        prediction_tables={'latest': prediction_table},
+        zone_ids=zone_ids
+    )
+
+
+def test_published_state_can_be_loaded(tmp_path, fake_model, prediction_table, all_valid_zone_ids):
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+
+    state = shared_state.load_published_state(str(tmp_path))
+
+    assert state['models']['latest'] == fake_model
+    assert state['prediction_tables']['latest'].zone_ids == prediction_table.zone_ids
+    assert state['model_versions'] == {'latest': 1}
+    assert state['zone_ids'] == all_valid_zone_ids
+
+
+def test_nothing_is_loaded_before_state_is_published(tmp_path):
+    assert shared_state.load_published_state(str(tmp_path)) is None
+
+
+def test_only_the_two_latest_states_are_kept(tmp_path, fake_model, all_valid_zone_ids):
+    published_file_names = []
+    for weeks_to_average in range(1, 4):
+        _publish(tmp_path, fake_model.__class__(weeks_to_average=weeks_to_average), None, all_valid_zone_ids)
+        published_file_names.append(shared_state._read_manifest(str(tmp_path))['models']['latest']['model'])
+
+    assert set(os.listdir(tmp_path)) == {shared_state.MANIFEST_FILE_NAME, *published_file_names[1:]}
+
+
+def test_unchanged_models_keep_their_version(tmp_path, fake_model, prediction_table, all_valid_zone_ids):
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+
+    assert shared_state.load_published_state(str(tmp_path))['model_versions'] == {'latest': 1}
+
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids[1:])
+
+    assert shared_state.load_published_state(str(tmp_path))['model_versions'] == {'latest': 3}
+
+
+def test_models_published_after_a_restart_replace_earlier_ones(tmp_path, fake_model, all_valid_zone_ids):
+    # a restarted ingestion process publishes a new model into the existing directory
+    _publish(tmp_path, fake_model.__class__(weeks_to_average=2), None, all_valid_zone_ids)
+    _publish(tmp_path, fake_model, None, all_valid_zone_ids)
+
+    state = shared_state.load_published_state(str(tmp_path))
+
+    assert state['models']['latest'] == fake_model
+    assert state['model_versions'] == {'latest': 2}
+
+
+def test_published_state_can_be_installed(tmp_path, fake_model, prediction_table, all_valid_zone_ids):
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+
+    keeper_of_the_state.install_state(**shared_state.load_published_state(str(tmp_path)))
+
+    assert keeper_of_the_state.provide_model('latest') == fake_model
+    assert keeper_of_the_state.provide_model_version('latest') == 1
+    assert keeper_of_the_state.provide_zones() == tuple(all_valid_zone_ids)
+
+
+@pytest.mark.asyncio
+async def test_following_state_survives_a_corrupt_manifest(tmp_path, monkeypatch, fake_model, prediction_table,
+                                                           all_valid_zone_ids):
+    monkeypatch.setattr(shared_state, 'PUBLISH_INTERVAL_SECONDS', 0.01)
+    (tmp_path / shared_state.MANIFEST_FILE_NAME).write_text('{"models": ')
+
+    follower = asyncio.ensure_future(shared_state.follow_published_state(str(tmp_path)))
+    try:
+        await asyncio.sleep(0.05)
+        assert not follower.done()
+
+        (tmp_path / shared_state.MANIFEST_FILE_NAME).unlink()
+        _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+        await asyncio.sleep(0.2)
+        assert keeper_of_the_state.provide_model('latest') == fake_model
+    finally:
+        follower.cancel()
+
+
+@pytest.mark.asyncio
+async def test_workers_wait_for_state_to_be_published(tmp_path, monkeypatch, fake_model, prediction_table,
+                                                      all_valid_zone_ids):
+    monkeypatch.setattr(shared_state, 'PUBLISH_INTERVAL_SECONDS', 0.01)
+    waiter = asyncio.ensure_future(shared_state.wait_for_published_state(str(tmp_path)))
+
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+
+    _publish(tmp_path, fake_model, prediction_table, all_valid_zone_ids)
+    assert await asyncio.wait_for(waiter, 1) is not None
+    assert keeper_of_the_state.provide_model('latest') == fake_model
+
+
+def test_published_availability_is_read_by_workers(tmp_path):
+    shared_state.publish_availability(str(tmp_path), {'red': 0.25, 'school': 1.0})
+    provider = shared_state.SharedAvailabilityProvider(str(tmp_path))
+
+    assert dict(provider.get_all_availability()) == {'red': 0.25, 'school': 1.0}
+
+    shared_state.publish_availability(str(tmp_path), {'danger': 0.5})
+
+    assert dict(provider.get_all_availability()) == {'danger': 0.5}
+
+
+def test_stale_availability_is_ignored(tmp_path, monkeypatch):
+    shared_state.publish_availability(str(tmp_path), {'red': 0.25})
+    provider = shared_state.SharedAvailabilityProvider(str(tmp_path))
+
+    published_at = shared_state.time.time()
+    monkeypatch.setattr(shared_state.time, 'time', lambda: published_at + 60 * shared_state.INVALID_AFTER_MINUTES + 1)
+
+    assert dict(provider.get_all_availability()) == {}
+
+
+def test_availability_is_empty_before_it_is_published(tmp_path):
+    provider = shared_state.SharedAvailabilityProvider(str(tmp_path))
+
+    assert dict(provider.get_all_availability()) == {}
@@ -14,8 +14,7 @@ import pyodbc
 from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
 from pytz import timezone
 
-from app import keeper_of_the_state, now_adjusted, predictor
-from app.constants import DAY_OF_WEEK, UNENFORCED_DAYS
+from app import enforcement_calendar, keeper_of_the_state, now_adjusted, occupancy_cache, predictor
 from app.model import ParkingAvailabilityModel
 
 LOGGER = logging.getLogger(__name__)
@@ -25,6 +24,34 @@ if sys.stdout.isatty():
 
 DIRNAME = Path(__file__).parent.absolute()
 
+SQL_CHUNK_SIZE = 250_000
+TRAINING_COLUMNS = ['zone_id', 'semihour', 'occu_cnt_rate', 'total_cnt']
+
+OCCUPANCY_COLUMNS = ['zone_name', 'semihour', 'no_trxn_one_week_flg', 'total_cnt', 'occu_cnt_rate', 'no_data']
+OCCUPANCY_QUERY = f'''
+    SELECT {', '.join(f'[{column}]' for column in OCCUPANCY_COLUMNS)}
+    FROM [dbo].[parking_zone_occupancy_aggr]
+    WHERE semihour >= ?
+    ORDER BY zone_name, semihour
+'''
+# the cache keeps every column, so that notebooks can read it too
+OCCUPANCY_CACHE_QUERY = '''
+    SELECT *
+    FROM [dbo].[parking_zone_occupancy_aggr]
+    WHERE semihour >= ?
+    ORDER BY zone_name, semihour
+'''
+# where to keep a local copy of the occupancy that full retraining reads, e.g.
+# data/raw/parking_zone_occupancy_aggr; unset, it is always read from the database
+OCCUPANCY_CACHE_DIR = os.getenv('OCCUPANCY_CACHE_DIR', '')
+
+# 'incremental' updates the latest model with occupancy newer than it was
+# trained on, falling back to 'full' retraining when it can not be updated
+TRAINING_MODE = os.getenv('TRAINING_MODE', 'incremental')
+# occupancy is re-read this far before the latest model's newest observation,
+# in case rows for it were still being aggregated when it was trained
+INCREMENTAL_OVERLAP = timedelta(days=1)
+
 
 @dataclass
 class SqlServerConfig:
@@ -44,23 +71,34 @@ class SqlServerConfig:
 
 
 def main():
-    occupancy_dataframe = _get_occupancy_data_from_database(_get_database_config())
-
-    model = ParkingAvailabilityModel()
+    database_config = _get_database_config()
 
-    model.train(
-        (occupancy_dataframe
-            .astype({'semihour': 'datetime64[ns]'})
-            .rename(columns={'zone_name': 'zone_id'})
-            .pipe(_remove_unoccupied_timeslots)
-            .pipe(_remove_times_outside_hours_of_operation))
-    )
+    model = _latest_updatable_model() if TRAINING_MODE == 'incremental' else None
+    if model is None:
+        model = ParkingAvailabilityModel()
+        model.train_incrementally(_get_occupancy_data(database_config))
+    else:
+        since = model.watermark - INCREMENTAL_OVERLAP
+        LOGGER.info(f'Updating the latest model with occupancy since {since}')
+        model.update(_get_occupancy_data(database_config, since))
 
     keeper_of_the_state.archive_model(model)
 
     # _validate_variance()
 
 
+def _latest_updatable_model():
+    latest_model = keeper_of_the_state.fetch_latest_model()
+    default_model = ParkingAvailabilityModel()
+
+    if not (isinstance(latest_model, ParkingAvailabilityModel)
+            and getattr(latest_model, 'watermark', None) is not None
+            and latest_model.weeks_to_average == default_model.weeks_to_average):
+        LOGGER.info('The latest model can not be updated, retraining it on all occupancy data')
+        return None
+    return latest_model
+
+
 def _get_database_config():
     config = configparser.RawConfigParser()
     config.read(DIRNAME / 'app/train.config')
@@ -75,43 +113,74 @@ def _get_database_config():
     )
 
 
-def _get_occupancy_data_from_database(database_config):
-    sql_query = '''
-        SELECT
-            [zone_name], [semihour], [occu_min], [occu_mtr_cnt],
-            [no_trxn_one_day_flg], [no_trxn_one_week_flg],
-            [total_cnt],
-            [occu_min_rate], [occu_cnt_rate],
-            [city_holiday], [shortnorth_event],
-            [no_data]
-        FROM [dbo].[parking_zone_occupancy_aggr]
-        WHERE CONVERT(date, semihour) >= CONVERT(date, DATEADD(month, -6, GETUTCDATE()))
-        ORDER BY zone_name, semihour
-    '''
+def _get_occupancy_data(database_config, since=None):
+    """
+    Read the last six months of occupancy data one chunk at a time, with each
+    chunk filtered down to the timeslots and columns that models train on.
+    Given `since`, only occupancy from that time on is read.
+
+    Without `since`, occupancy is read from the local occupancy cache after
+    refreshing it, if it is enabled and Parquet can be written. Occupancy
+    since a time is read straight from the database, since it is only the
+    little that is newer than the latest model.
+    """
+    six_months_ago = pd.Timestamp.utcnow().tz_localize(None).normalize() - pd.DateOffset(months=6)
+    use_cache = since is None and OCCUPANCY_CACHE_DIR and occupancy_cache.available()
+    since = six_months_ago if since is None else max(since, six_months_ago)
+
+    if use_cache:
+        occupancy_cache.refresh(
+            OCCUPANCY_CACHE_DIR,
+            lambda refresh_since: _sql_read(database_config, OCCUPANCY_CACHE_QUERY, [refresh_since.to_pydatetime()]),
+            six_months_ago
+        )
+        occupancy_source = f'the occupancy cache in {OCCUPANCY_CACHE_DIR}'
+        occupancy_chunks = occupancy_cache.read_chunks(OCCUPANCY_CACHE_DIR, OCCUPANCY_COLUMNS, since)
+    else:
+        occupancy_source = 'DB'
+        occupancy_chunks = _sql_read(database_config, OCCUPANCY_QUERY, [since.to_pydatetime()])
 
+    rows_read = rows_kept = 0
+    zone_ids = set()
     try:
-        occupancy_dataframe = _sql_read(database_config, sql_query)
+        for occupancy_chunk in occupancy_chunks:
+            training_chunk = _to_training_chunk(occupancy_chunk)
+            rows_read += len(occupancy_chunk)
+            rows_kept += len(training_chunk)
+            zone_ids.update(training_chunk.zone_id.unique())
+            yield training_chunk
     except Exception as e:
         LOGGER.error(f'Unexpected error: {e}')
         raise e
 
-    if not occupancy_dataframe.empty:
-        LOGGER.info('Read data from DB into dataframe successfully.')
-        LOGGER.info(f'Total (row, col) counts for dataframe: {occupancy_dataframe.shape}')
-        LOGGER.info(f'Zones in dataframe: {len(occupancy_dataframe["zone_name"].unique())}')
+    if rows_read:
+        LOGGER.info(f'Read data from {occupancy_source} successfully.')
+        LOGGER.info(f'Total rows read: {rows_read}, kept for training: {rows_kept}')
+        LOGGER.info(f'Zones in data: {len(zone_ids)}')
     else:
-        LOGGER.error(f'No data read from DB: {occupancy_dataframe}')
-        raise Exception('No data read from DB')
+        LOGGER.error(f'No data read from {occupancy_source}')
+        raise Exception(f'No data read from {occupancy_source}')
 
-    return occupancy_dataframe
 
-
-def _sql_read(database_config, sql_query):
+def _sql_read(database_config, sql_query, sql_params=()):
     LOGGER.info(f'Reading data from DB {database_config.server}')
     LOGGER.debug('Performing DB read with spec of %s', database_config.__dict__)
 
     with pyodbc.connect(**database_config.__dict__) as conn:
-        return pd.concat(list(pd.read_sql_query(sql_query, conn, chunksize=10 ** 6)), ignore_index=True)
+        yield from pd.read_sql_query(sql_query, conn, params=list(sql_params), chunksize=SQL_CHUNK_SIZE)
+
+
+def _to_training_chunk(occupancy_chunk: pd.DataFrame) -> pd.DataFrame:
+    return (
+        occupancy_chunk
+            .astype({'semihour': 'datetime64[ns]'})
+            .rename(columns={'zone_name': 'zone_id'})
+            .pipe(_remove_unoccupied_timeslots)
+            .pipe(_remove_times_outside_hours_of_operation)
+            .loc[:, TRAINING_COLUMNS]
+            .astype({'zone_id': 'category', 'occu_cnt_rate': 'float32'})
+            .assign(total_cnt=lambda df: pd.to_numeric(df.total_cnt, downcast='integer'))
+    )
 
 
 def _remove_unoccupied_timeslots(occupancy_dataframe: pd.DataFrame) -> pd.DataFrame:
@@ -122,15 +191,8 @@ def _remove_unoccupied_timeslots(occupancy_dataframe: pd.DataFrame) -> pd.DataFr
 
 
 def _remove_times_outside_hours_of_operation(occupancy_dataframe: pd.DataFrame) -> pd.DataFrame:
-    enforcement_days = [day.value for day in DAY_OF_WEEK
-                        if day not in UNENFORCED_DAYS]
-    return (
-        occupancy_dataframe
-            .set_index('semihour')
-            .between_time('08:00', '22:00', include_end=False)
-            .reset_index()
-            .loc[lambda df: df.semihour.dt.dayofweek.isin(enforcement_days), :]
-    )
+    slot_codes = enforcement_calendar.slot_codes(occupancy_dataframe.semihour)
+    return occupancy_dataframe.loc[slot_codes != enforcement_calendar.NOT_ENFORCED]
 
 
 def _validate_variance():
@@ -153,6 +215,8 @@ def _validate_variance():
     for prediction in predictions:
         prediction_yesterday = prediction[f'{yesterday_model}Prediction']
         prediction_today = prediction[f'{today_model}Prediction']
+        if prediction_yesterday is None or prediction_today is None:
+            continue
         variance = abs(round(prediction_today - prediction_yesterday, 10))
         zone = prediction['zoneId']
         gauge.labels(zone=zone).set(variance)